@@ -0,0 +1,162 @@
+import numpy as np
+
+from game import START, BLANK, ENEMY, TRAP, CRACK, TREASURE, SWORD, KEY, PORTAL, PLATFORM
+
+
+class BatchPlayer:
+    """N independent Player2 agents on the same level, advanced together.
+
+    Every agent has its own position, inventory, life and set of consumed
+    objects, so the level itself is never modified. The reactions of the cells
+    follow Player2.grid_reaction, including the chains triggered by portals,
+    moving platforms and traps.
+    """
+
+    def __init__(self, level, n, HP=3, rng=None):
+        """Initializes the agents on the starting position.
+
+        Args:
+            level (Level): Level the agents play on.
+            n (int): Number of agents.
+            HP (int): Initial life of the agents.
+            rng (numpy.random.Generator or int): Random generator, or seed of
+                a new one. Runs with the same seed are identical.
+        """
+        self.n = n
+        self.HP = HP
+        self.rng = np.random.default_rng(rng)
+        self.max_line = level.nbLine
+        self.max_col = level.nbCol
+        self.tiles = level.tiles.flatten()
+        self.start = self.tiles.size - 1
+
+        # neighbours and portal destinations, see Level.build_tables
+        self.next_cell = level.next_cell
+        self.free_cells = level.free_cells
+        self.free_rank = level.free_rank
+
+        # objects that can be picked up
+        items = np.flatnonzero(np.isin(self.tiles, (KEY, TREASURE, SWORD)))
+        self.item_index = np.full(self.tiles.size, -1)
+        self.item_index[items] = np.arange(len(items))
+        self.nb_items = len(items)
+        self.reset()
+
+    def reset(self):
+        """Puts every agent back on the starting position with full life."""
+        self.pos = np.full(self.n, self.start)
+        self.prev_pos = self.pos.copy()
+        self.has_key = np.zeros(self.n, dtype=bool)
+        self.has_sword = np.zeros(self.n, dtype=bool)
+        self.has_treasure = np.zeros(self.n, dtype=bool)
+        self.win = np.zeros(self.n, dtype=bool)
+        self.life = np.full(self.n, self.HP)
+        self.consumed = np.zeros((self.n, self.nb_items), dtype=bool)
+
+    @property
+    def x_pos(self):
+        return self.pos % self.max_col
+
+    @property
+    def y_pos(self):
+        return self.pos // self.max_col
+
+    def is_dead(self):
+        return self.life <= 0
+
+    def done(self):
+        return self.is_dead() | self.win
+
+    def get_state(self):
+        """Returns the has_key, has_sword, has_treasure and critical arrays,
+        see Player2.get_state."""
+        return self.has_key, self.has_sword, self.has_treasure, self.life <= 1
+
+    def cells(self, agents):
+        """Returns the tile code under the specified agents, taking the objects
+        they already picked up into account."""
+        pos = self.pos[agents]
+        tiles = self.tiles[pos]
+        item = self.item_index[pos]
+        picked = item >= 0
+        picked[picked] = self.consumed[agents[picked], item[picked]]
+        tiles[picked] = BLANK
+        return tiles
+
+    def step(self, actions):
+        """Moves every agent that is still playing, then triggers the reactions
+        of the cells reached. Agents that bump into a wall do not react.
+
+        Args:
+            actions (ndarray): Action of each agent, 0 up, 1 down, 2 right,
+                3 left.
+
+        Returns:
+            (ndarray) whether each agent moved.
+        """
+        playing = ~self.done()
+        target = self.next_cell[self.pos, actions]
+        moved = playing & (target >= 0)
+        self.prev_pos[playing] = self.pos[playing]
+        self.pos[moved] = target[moved]
+
+        agents = np.flatnonzero(moved)
+        while len(agents):
+            agents = self.react(agents)
+        return moved
+
+    def react(self, agents):
+        """Applies the reaction of the cell under each of the specified agents.
+
+        Returns:
+            (ndarray) agents whose reaction chains to the next cell.
+        """
+        tiles = self.cells(agents)
+
+        def pick(mask):
+            picked = agents[mask]
+            self.consumed[picked, self.item_index[self.pos[picked]]] = True
+            return picked
+
+        self.has_key[pick(tiles == KEY)] = True
+        self.has_sword[pick(tiles == SWORD)] = True
+        self.has_treasure[pick((tiles == TREASURE) & self.has_key[agents])] = True
+        self.win[agents[(tiles == START) & self.has_treasure[agents]]] = True
+
+        enemy = (tiles == ENEMY) & ~self.has_sword[agents]
+        hurt = enemy & (self.rng.random(len(agents)) < 0.3)
+        hurt |= tiles == CRACK
+
+        trap = np.flatnonzero(tiles == TRAP)
+        draw = self.rng.random(len(trap))
+        hurt[trap[draw <= 0.1]] = True
+        back = trap[(draw > 0.1) & (draw <= 0.3)]
+        self.pos[agents[back]] = self.start
+        self.life[agents[hurt]] -= 1
+
+        # teleport to a random free cell other than the previous position
+        portal = agents[tiles == PORTAL]
+        if len(portal):
+            rank = self.rng.integers(len(self.free_cells) - 1, size=len(portal))
+            rank += rank >= self.free_rank[self.prev_pos[portal]]
+            self.pos[portal] = self.free_cells[rank]
+
+        # pushed to a random neighbour that is not on the line or column of
+        # the previous position
+        platform = agents[tiles == PLATFORM]
+        if len(platform):
+            exits = self.next_cell[self.pos[platform]]
+            prev_y, prev_x = np.divmod(self.prev_pos[platform], self.max_col)
+            exit_y, exit_x = np.divmod(exits, self.max_col)
+            valid = exits >= 0
+            valid[:, :2] &= exit_y[:, :2] != prev_y[:, None]
+            valid[:, 2:] &= exit_x[:, 2:] != prev_x[:, None]
+            count = valid.sum(axis=1)
+            pushed = count > 0
+            choice = (self.rng.random(len(platform)) * count).astype(int)
+            column = np.argmax(np.cumsum(valid, axis=1) > choice[:, None], axis=1)
+            self.pos[platform[pushed]] = exits[pushed, column[pushed]]
+            platform = platform[pushed]
+
+        chain = np.concatenate((agents[back], portal, platform))
+        return chain[self.life[chain] > 0]
@@ -0,0 +1,179 @@
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import zipfile
+
+import numpy as np
+
+from game import HEADER, MAGIC, Level, decode_lines
+
+# parameters of generate_carved stored in the index of a corpus
+PARAMS = [('nb_line', np.int32), ('nb_col', np.int32), ('pw', np.float64), ('po', np.float64),
+          ('pc', np.float64), ('max_key', np.int32), ('max_sword', np.int32), ('max_portal', np.int32)]
+INDEX = np.dtype(PARAMS + [('offset', np.int64)])
+
+
+def generate_tiles(nb_line, nb_col, pw, po, pc, max_key, max_sword, max_portal, seed):
+    """Returns the tile codes of a solvable level, see Level.generate_carved."""
+    level = Level()
+    level.generate_carved(nb_line, nb_col, pw, po, pc, max_key, max_sword, max_portal,
+                          np.random.default_rng(seed))
+    return level.tiles
+
+
+def build_corpus(filename, specs, seed=0, workers=None, chunksize=64):
+    """Generates one solvable level per spec and packs them into a single
+    .npz archive.
+
+    The archive holds `tiles`, the tile codes of every level flattened one
+    after the other, and `index`, one record per level with the parameters of
+    the level and the offset of its tiles. Every level gets its own seed
+    spawned from `seed`, so a corpus only depends on `specs` and `seed`, not
+    on the number of workers. The tiles of each level are written to the
+    archive as soon as they are generated, so only the levels not written
+    yet are held in memory.
+
+    Args:
+        filename (str): Archive to write.
+        specs (list): (nb_line, nb_col, pw, po, pc, max_key, max_sword,
+            max_portal) tuple of each level.
+        seed (int): Master seed of the corpus.
+        workers (int): Number of processes. 1 generates the levels in the
+            current process, None uses one process per CPU.
+        chunksize (int): Number of levels sent to a process at a time.
+
+    Returns:
+        (ndarray) the index of the corpus.
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(specs))
+    columns = [[spec[i] for spec in specs] for i in range(len(PARAMS))]
+    index = np.zeros(len(specs), dtype=INDEX)
+    for (name, _), column in zip(PARAMS, columns):
+        index[name] = column
+    sizes = index['nb_line'].astype(np.int64) * index['nb_col']
+    index['offset'] = np.cumsum(sizes) - sizes
+
+    # same layout as np.savez: uncompressed members, .npz appended to the name
+    if not filename.endswith('.npz'):
+        filename += '.npz'
+    with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        with archive.open('tiles.npy', 'w', force_zip64=True) as member:
+            np.lib.format.write_array_header_2_0(
+                member, {'descr': '|u1', 'fortran_order': False, 'shape': (int(sizes.sum()),)})
+            if workers == 1:
+                for tiles in map(generate_tiles, *columns, seeds):
+                    member.write(tiles.tobytes())
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    for tiles in pool.map(generate_tiles, *columns, seeds, chunksize=chunksize):
+                        member.write(tiles.tobytes())
+        with archive.open('index.npy', 'w', force_zip64=True) as member:
+            np.lib.format.write_array(member, index)
+    return index
+
+
+def corpus_level(tiles, index, i, name="N/A"):
+    """Returns level `i` of a corpus as a Level.
+
+    Args:
+        tiles (ndarray): `tiles` array of the archive.
+        index (ndarray): `index` array of the archive.
+        i (int): Position of the level in the corpus.
+        name (str): Name given to the level.
+    """
+    record = index[i]
+    level = Level()
+    level.name = name
+    level.nbLine = int(record['nb_line'])
+    level.nbCol = int(record['nb_col'])
+    size = level.nbLine * level.nbCol
+    level.set_tiles(np.array(tiles[record['offset']:record['offset'] + size]).reshape(level.nbLine, level.nbCol))
+    return level
+
+
+def iter_corpus(path, shard=0, num_shards=1):
+    """Yields the levels of a corpus one at a time.
+
+    A corpus is either an archive written by build_corpus, binary levels
+    written one after the other (see Level.save) or text levels written one
+    after the other. The format is detected from the first bytes of the file.
+    Only one level is held in memory at a time, and the levels of the other
+    shards are skipped without being decoded.
+
+    Args:
+        path (str): Corpus file.
+        shard (int): Index of the shard to read, level i belongs to shard
+            i % num_shards.
+        num_shards (int): Number of shards the corpus is split into.
+
+    Yields:
+        (Level) the levels of the shard, named path:i.
+    """
+    if not 0 <= shard < num_shards:
+        raise ValueError("Invalid shard {} of {}".format(shard, num_shards))
+    with open(path, "rb") as file:
+        magic = file.read(len(MAGIC))
+    if magic == MAGIC:
+        levels = _iter_binary(path, shard, num_shards)
+    elif zipfile.is_zipfile(path):
+        levels = _iter_archive(path, shard, num_shards)
+    else:
+        levels = _iter_text(path, shard, num_shards)
+    for i, level in levels:
+        level.name = "{}:{}".format(path, i)
+        yield level
+
+
+def _iter_archive(path, shard, num_shards):
+    # tiles.npy is stored uncompressed, each level is read at its offset
+    with zipfile.ZipFile(path) as archive:
+        with archive.open('index.npy') as member:
+            index = np.lib.format.read_array(member)
+        with archive.open('tiles.npy') as member:
+            if np.lib.format.read_magic(member) == (1, 0):
+                np.lib.format.read_array_header_1_0(member)
+            else:
+                np.lib.format.read_array_header_2_0(member)
+            start = member.tell()
+            for i in range(shard, len(index), num_shards):
+                record = index[i]
+                level = Level()
+                level.nbLine = int(record['nb_line'])
+                level.nbCol = int(record['nb_col'])
+                member.seek(start + int(record['offset']))
+                tiles = bytearray(member.read(level.nbLine * level.nbCol))
+                level.set_tiles(np.frombuffer(tiles, dtype=np.uint8).reshape(level.nbLine, level.nbCol))
+                yield i, level
+
+
+def _iter_binary(path, shard, num_shards):
+    # only the headers of the levels of the other shards are read
+    offset = 0
+    with open(path, "rb") as file:
+        for i in itertools.count():
+            file.seek(offset)
+            header = np.frombuffer(file.read(HEADER.itemsize), dtype=HEADER)
+            if len(header) == 0:
+                return
+            if i % num_shards == shard:
+                level = Level()
+                level.load_binary(path, offset)
+                yield i, level
+            offset += HEADER.itemsize + int(header['nb_line'][0]) * int(header['nb_col'][0])
+
+
+def _iter_text(path, shard, num_shards):
+    i = 0
+    with open(path, "r") as file:
+        for line in file:
+            if "lines : " in line:
+                nb_line = int(line[8:])
+            elif "columns : " in line:
+                nb_col = int(line[9:])
+                lines = list(itertools.islice(file, nb_line))
+                if i % num_shards == shard:
+                    level = Level()
+                    level.nbLine = nb_line
+                    level.nbCol = nb_col
+                    level.set_tiles(decode_lines(lines, nb_line, nb_col, path))
+                    yield i, level
+                i += 1
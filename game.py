@@ -2,13 +2,74 @@ import random
 import player
 import os
 
+import numpy as np
+from scipy import ndimage
+
+# (dy, dx) of the moves in the order of the next cell table: up, down, right, left
+MOVES = ((-1, 0), (1, 0), (0, 1), (0, -1))
+
+# tile codes of Level.tiles, TILES[code] is the character of the level files
+TILES = 'SB_ERCTWKPM'
+START, BLANK, WALL, ENEMY, TRAP, CRACK, TREASURE, SWORD, KEY, PORTAL, PLATFORM = range(len(TILES))
+CODES = {char: code for code, char in enumerate(TILES)}
+# code of each byte of a level file, 255 for the unknown characters
+BYTE_CODES = np.full(256, 255, dtype=np.uint8)
+BYTE_CODES[np.frombuffer(TILES.encode('ascii'), dtype=np.uint8)] = np.arange(len(TILES))
+CHARS = np.array(list(TILES))
+
+# binary level files: HEADER followed by the nbLine * nbCol tile codes
+MAGIC = b'LVL1'
+HEADER = np.dtype([('magic', 'S4'), ('nb_line', '<u4'), ('nb_col', '<u4')])
+BINARY_EXTENSION = '.lvl'
+
+
+def monotone_path(rng, origin, goal):
+    """Returns the ys and xs arrays of the cells of a random path from origin
+    to goal, (y, x) tuples, that only moves towards goal."""
+    dy, dx = goal[0] - origin[0], goal[1] - origin[1]
+    vertical = np.zeros(abs(dy) + abs(dx), dtype=bool)
+    vertical[:abs(dy)] = True
+    vertical = rng.permutation(vertical)
+    ys = origin[0] + np.sign(dy) * np.concatenate(([0], np.cumsum(vertical)))
+    xs = origin[1] + np.sign(dx) * np.concatenate(([0], np.cumsum(~vertical)))
+    return ys, xs
+
+
+def decode_lines(lines, nb_line, nb_col, name="N/A"):
+    """Returns the (nb_line, nb_col) tile codes of the comma separated lines
+    of a text level, `name` is the level reported in the errors. Blank lines
+    are skipped."""
+    # one character out of two, the others are the commas
+    codes = [np.frombuffer(line.strip('\n').encode('ascii'), dtype=np.uint8)[::2] for line in lines
+             if line.strip()]
+    if len(codes) != nb_line:
+        raise ValueError("Expected {} lines, got {} in {}".format(nb_line, len(codes), name))
+    if any(len(row) != nb_col for row in codes):
+        raise ValueError("Expected {} columns in {}".format(nb_col, name))
+    tiles = BYTE_CODES[np.array(codes, dtype=np.uint8).reshape(nb_line, nb_col)]
+    if (tiles == 255).any():
+        raise ValueError("Unknown tile in {}".format(name))
+    return tiles
+
 
 class Level:
     def __init__(self):
         self.name = "N/A"
         self.nbLine = 0
         self.nbCol = 0
-        self.grid = []
+        # (nbLine, nbCol) uint8 tile codes, grid the lists of their
+        # characters for the code that reads grid[y][x], built on first use
+        # and kept up to date by set_tile
+        self.tiles = np.zeros((0, 0), dtype=np.uint8)
+        self._grid = None
+        # compiled transition models, see mdp.compile_model
+        self.models = dict()
+        # (y, x, object) of the objects picked up, see consume and restore
+        self.consumed = []
+        # connected components of the passable cells, see components
+        self.labels = None
+        # lookup tables, see build_tables, built on first use
+        self._tables = None
         # S : start
         # B : blank
         # _ : wall
@@ -22,11 +83,21 @@ class Level:
         # M : moving platform
 
     # generate a labyrinth with a proportion of pw wall, po obstacles, pc cracks,
-    # between 1 and max_key keys, 0 and max_sword swords and 0 and max_portal portals
-    def generate_solvable(self, nb_line, nb_col, pw, po, pc, max_key, max_sword, max_portal):
+    # between 1 and max_key keys, 0 and max_sword swords and 0 and max_portal portals.
+    # strategy 'retry' generates random levels until one is solvable, at most 10
+    # times, 'carve' carves a way to a key and to the treasure and never fails.
+    # rng is the numpy Generator or seed of the 'carve' strategy
+    def generate_solvable(self, nb_line, nb_col, pw, po, pc, max_key, max_sword, max_portal,
+                          strategy='retry', rng=None):
         if nb_line < 4 or nb_col < 4:
             print("dimensions too small")
             return
+        if strategy == 'carve':
+            self.generate_carved(nb_line, nb_col, pw, po, pc, max_key, max_sword, max_portal, rng)
+            print("grid generated")
+            return
+        if strategy != 'retry':
+            raise ValueError("Invalid strategy: {}".format(strategy))
         self.generate(nb_line, nb_col, pw, po, pc, max_key, max_sword, max_portal)
         cpt = 0
         while not self.solvable() and cpt < 10:
@@ -34,39 +105,79 @@ class Level:
             cpt += 1
         if cpt == 10:
             print("parameters are too bad to find a solvable solution, please lower pw, po or pc")
-            self.grid = []
+            self.nbLine = 0
+            self.nbCol = 0
+            self.set_tiles(np.zeros((0, 0), dtype=np.uint8))
         else:
             print("grid generated")
 
     def generate(self, nb_line, nb_col, pw, po, pc, max_key, max_sword, max_portal):
         self.nbLine = nb_line
         self.nbCol = nb_col
-        self.grid = []
-        for i in range(nb_line):
-            line = ['B'] * nb_col
-            self.grid.append(line)
+        tiles = np.full((nb_line, nb_col), BLANK, dtype=np.uint8)
         for i in range(nb_line):
             for j in range(nb_col):
                 if random.uniform(0, 1) < pw:
-                    self.grid[i][j] = '_'
+                    tiles[i, j] = WALL
                 elif random.uniform(0, 1) < po:
                     if random.randint(0, 1) == 0:
-                        self.grid[i][j] = 'E'
+                        tiles[i, j] = ENEMY
                     else:
-                        self.grid[i][j] = 'R'
+                        tiles[i, j] = TRAP
                 elif random.uniform(0, 1) < pc:
-                    self.grid[i][j] = 'C'
+                    tiles[i, j] = CRACK
         for key in range(max_sword):
-            self.grid[random.randint(0, nb_line-1)][random.randint(0, nb_col-1)] = 'W'
+            tiles[random.randint(0, nb_line-1), random.randint(0, nb_col-1)] = SWORD
         for key in range(max_portal):
-            self.grid[random.randint(0, nb_line-1)][random.randint(0, nb_col-1)] = 'P'
+            tiles[random.randint(0, nb_line-1), random.randint(0, nb_col-1)] = PORTAL
         for key in range(max_key):
-            self.grid[random.randint(0, nb_line-1)][random.randint(0, nb_col-1)] = 'K'
-        self.grid[0][0] = 'T'
-        self.grid[self.nbLine - 1][self.nbCol - 1] = 'S'
+            tiles[random.randint(0, nb_line-1), random.randint(0, nb_col-1)] = KEY
+        tiles[0, 0] = TREASURE
+        tiles[self.nbLine - 1, self.nbCol - 1] = START
+        self.set_tiles(tiles)
+
+    # same proportions as generate, sampled with numpy, then the walls and the
+    # cracks are removed from a random monotone path from the start to a key
+    # and from that key to the treasure, so that the level is always solvable
+    def generate_carved(self, nb_line, nb_col, pw, po, pc, max_key, max_sword, max_portal, rng=None):
+        rng = np.random.default_rng(rng)
+        self.nbLine = nb_line
+        self.nbCol = nb_col
+        tiles = np.full((nb_line, nb_col), BLANK, dtype=np.uint8)
+        wall = rng.random((nb_line, nb_col), dtype=np.float32) < pw
+        obstacle = ~wall & (rng.random((nb_line, nb_col), dtype=np.float32) < po)
+        crack = ~wall & ~obstacle & (rng.random((nb_line, nb_col), dtype=np.float32) < pc)
+        tiles[wall] = WALL
+        tiles[obstacle] = np.where(rng.random(obstacle.sum()) < 0.5, ENEMY, TRAP)
+        tiles[crack] = CRACK
+        for code, count in ((SWORD, max_sword), (PORTAL, max_portal), (KEY, max_key - 1)):
+            count = max(count, 0)
+            tiles[rng.integers(nb_line, size=count), rng.integers(nb_col, size=count)] = code
+
+        # key at the end of the first path, anywhere but on the treasure or the start
+        key = divmod(int(rng.integers(1, nb_line * nb_col - 1)), nb_col)
+        start = (nb_line - 1, nb_col - 1)
+        for origin, goal in ((start, key), (key, (0, 0))):
+            ys, xs = monotone_path(rng, origin, goal)
+            path = tiles[ys, xs]
+            tiles[ys, xs] = np.where((path == WALL) | (path == CRACK), BLANK, path)
+        tiles[key] = KEY
+        tiles[0, 0] = TREASURE
+        tiles[start] = START
+        self.set_tiles(tiles)
 
+    # the format is detected from the first bytes of the file
     def load(self, filename):
+        with open(filename, "rb") as file:
+            binary = file.read(len(MAGIC)) == MAGIC
+        if binary:
+            self.load_binary(filename)
+        else:
+            self.load_text(filename)
+
+    def load_text(self, filename):
         self.name = filename
+        lines = []
         file = open(self.name, "r")
         for line in file:
             if "lines : " in line:
@@ -74,73 +185,186 @@ class Level:
             elif "columns : " in line:
                 self.nbCol = int(line[9:])
             else:
-                self.grid.append(line.strip('\n').split(","))
-
-    def save(self, filename):
-        file = open(filename, "w")
-        file.write("lines : " + str(self.nbLine) + '\n')
-        file.write("columns : " + str(self.nbCol) + '\n')
-        for line in self.grid:
-            tmp = ""
-            for char in line:
-                tmp += char+","
-            file.write(tmp[:-1] + '\n')
+                lines.append(line)
+        file.close()
+        self.set_tiles(decode_lines(lines, self.nbLine, self.nbCol, filename))
+
+    # the tiles are mapped copy on write, picking objects up never writes to
+    # the file
+    def load_binary(self, filename, offset=0):
+        self.name = filename
+        header = np.fromfile(filename, dtype=HEADER, count=1, offset=offset)
+        if len(header) == 0 or header['magic'][0] != MAGIC:
+            raise ValueError("Not a binary level: {}".format(filename))
+        self.nbLine = int(header['nb_line'][0])
+        self.nbCol = int(header['nb_col'][0])
+        tiles = np.memmap(filename, dtype=np.uint8, mode='c', offset=offset + HEADER.itemsize,
+                          shape=(self.nbLine, self.nbCol))
+        if (tiles >= len(TILES)).any():
+            raise ValueError("Unknown tile in {}".format(filename))
+        self.set_tiles(tiles)
+
+    # replace the content of the level by the (nbLine, nbCol) tile codes
+    def set_tiles(self, tiles):
+        self.tiles = tiles
+        self._grid = None
+        self.models = dict()
+        self.consumed = []
+        self.labels = None
+        self._tables = None
+
+    @property
+    def grid(self):
+        if self._grid is None:
+            self._grid = CHARS[self.tiles].tolist()
+        return self._grid
+
+    # write the tile code of (y, x), and its character in grid
+    def set_tile(self, y, x, code):
+        self.tiles[y, x] = code
+        if self._grid is not None:
+            self._grid[y][x] = TILES[code]
+
+    # cells are numbered y * nbCol + x. next_cell[cell][action] is the cell
+    # reached by moving from cell in the direction of MOVES, -1 for walls and
+    # borders. free_cells are the cells that are not walls and free_rank their
+    # position in free_cells. platform_exits[cell] are the (action, cell)
+    # moves out of each moving platform. The tables are built together, the
+    # first time one of them is read
+    def build_tables(self):
+        wall = np.asarray(self.tiles) == WALL
+        padded = np.full((self.nbLine + 2, self.nbCol + 2), -1, dtype=np.int32)
+        padded[1:-1, 1:-1] = np.arange(self.nbLine * self.nbCol, dtype=np.int32).reshape(wall.shape)
+        padded[1:-1, 1:-1][wall] = -1
+        next_cell = np.empty((self.nbLine * self.nbCol, len(MOVES)), dtype=np.int32)
+        by_action = next_cell.reshape(self.nbLine, self.nbCol, len(MOVES))
+        for action, (dy, dx) in enumerate(MOVES):
+            by_action[:, :, action] = padded[1 + dy:1 + dy + self.nbLine, 1 + dx:1 + dx + self.nbCol]
+        free_cells = np.flatnonzero(~wall).astype(np.int32)
+        free_rank = np.full(self.nbLine * self.nbCol, -1, dtype=np.int32)
+        free_rank[free_cells] = np.arange(len(free_cells), dtype=np.int32)
+        platform_exits = dict()
+        for cell in np.flatnonzero(self.tiles == PLATFORM).tolist():
+            platform_exits[cell] = [(action, c) for action, c in enumerate(next_cell[cell].tolist()) if c >= 0]
+        self._tables = (next_cell, free_cells, free_rank, platform_exits)
+
+    def _table(self, i):
+        if self._tables is None:
+            self.build_tables()
+        return self._tables[i]
+
+    @property
+    def next_cell(self):
+        return self._table(0)
+
+    @property
+    def free_cells(self):
+        return self._table(1)
+
+    @property
+    def free_rank(self):
+        return self._table(2)
+
+    @property
+    def platform_exits(self):
+        return self._table(3)
+
+    # replace the object on (y, x) by an empty room, undone by restore. The
+    # compiled models no longer match the tiles and are dropped
+    def consume(self, y, x):
+        self.consumed.append((y, x, self.tiles.item(y, x)))
+        self.set_tile(y, x, BLANK)
+        self.models = dict()
+
+    # O(1) marker of the current objects, to be passed to restore
+    def snapshot(self):
+        return len(self.consumed)
+
+    # put back the objects consumed since the snapshot, without reloading the file
+    def restore(self, snapshot=0):
+        if len(self.consumed) > snapshot:
+            self.models = dict()
+        while len(self.consumed) > snapshot:
+            y, x, code = self.consumed.pop()
+            self.set_tile(y, x, code)
+
+    # fmt 'text' writes the lines / columns header and the comma separated
+    # tiles, 'binary' the HEADER and the raw tile codes. By default the files
+    # with the BINARY_EXTENSION are binary. Binary files are written next to
+    # filename then moved over it, the tiles may be mapped from filename
+    def save(self, filename, fmt=None):
+        if fmt is None:
+            fmt = 'binary' if filename.endswith(BINARY_EXTENSION) else 'text'
+        if fmt == 'binary':
+            temp = filename + ".tmp"
+            file = open(temp, "wb")
+            np.array([(MAGIC, self.nbLine, self.nbCol)], dtype=HEADER).tofile(file)
+            np.ascontiguousarray(self.tiles, dtype=np.uint8).tofile(file)
+            file.close()
+            os.replace(temp, filename)
+        elif fmt == 'text':
+            file = open(filename, "w")
+            file.write("lines : " + str(self.nbLine) + '\n')
+            file.write("columns : " + str(self.nbCol) + '\n')
+            for line in CHARS[self.tiles].tolist():
+                file.write(",".join(line) + '\n')
+            file.close()
+        else:
+            raise ValueError("Invalid format: {}".format(fmt))
 
     def display(self):
-        for line in self.grid:
-            for char in line:
-                print(char+" ", end='')
-            print()
+        for line in CHARS[self.tiles].tolist():
+            print(" ".join(line) + " ")
 
     def player_display(self, y, x, life):
         print("life :" + str(life))
-        tmp = self.grid[y][x]
-        self.grid[y][x] = u"\u25A1"
-        for line in self.grid:
-            for char in line:
-                print(char+" ", end='')
-            print()
-        self.grid[y][x] = tmp
+        chars = CHARS[self.tiles].tolist()
+        chars[y][x] = u"\u25A1"
+        for line in chars:
+            print(" ".join(line) + " ")
 
     def solvable(self):
-        if self.grid:
-            if not self.has_key():
-                return False
-            if not self.way_possible("K"):
-                return False
-            if not self.way_possible("T"):
-                return False
-            return True
+        if self.tiles.size:
+            reachable = self.reachable_tiles()
+            return KEY in reachable and TREASURE in reachable
         else:
             print("grid not loaded")
             return False
 
     def has_key(self):
-        for row in self.grid:
-            for cell in row:
-                if cell == "K":
-                    return True
-        return False
+        return bool((self.tiles == KEY).any())
 
     def way_possible(self, objective):
-        Q = []
-        visited = []
-        Q.append([self.nbLine - 1, self.nbCol - 1])
-        visited.append([self.nbLine - 1, self.nbCol - 1])  # start is visited
-        while len(Q) > 0:
-            node = Q.pop()
-            neighbours = [[node[0] - 1, node[1]], [node[0] + 1, node[1]], [node[0], node[1] - 1],
-                          [node[0], node[1] + 1]]
-            for n in neighbours:
-                if 0 <= n[0] < self.nbLine and 0 <= n[1] < self.nbCol:
-                    if self.grid[n[0]][n[1]] == objective:
-                        return True
-                    else:
-                        if self.grid[n[0]][n[1]] != "_" and self.grid[n[0]][n[1]] != "C":
-                            if n not in visited:
-                                Q.append(n)
-                                visited.append(n)
-        return False
+        return CODES[objective] in self.reachable_tiles()
+
+    # labels of the 4-connected components of the cells that can be walked on
+    # without dying (neither walls nor cracks), 0 for the other cells. The
+    # labelling is done once per level, picking objects up does not change it
+    def components(self):
+        if self.labels is None:
+            self.labels, _ = ndimage.label((self.tiles != WALL) & (self.tiles != CRACK))
+        return self.labels
+
+    # mask of the component of the start
+    def start_component(self):
+        labels = self.components()
+        start = labels[self.nbLine - 1, self.nbCol - 1]
+        if start == 0:
+            return np.zeros(labels.shape, dtype=bool)
+        return labels == start
+
+    # codes of the tiles that can be walked to from the start
+    def reachable_tiles(self):
+        return set(np.unique(self.tiles[self.start_component()]).tolist())
+
+    # mask of the cells the player can end up on: the component of the start
+    # and the cracks around it, or every cell that is not a wall when a portal
+    # can be reached. The solvers can drop the other cells
+    def reachable(self):
+        component = self.start_component()
+        if (self.tiles[component] == PORTAL).any():
+            return self.tiles != WALL
+        return component | (ndimage.binary_dilation(component) & (self.tiles == CRACK))
 
     def display_policy(self, p):
         chars = {
@@ -185,6 +185,7 @@ def user_play():
     GAME['user_loop'] = True
     while GAME['user_loop']:
 
+        GAME['level'].restore()
         GAME['player'] = Player2(GAME['level'])
         cli.add_status("You can play with ZQSD on Windows or the arrow keys on unix.")
         cli.add_status("Press (e) to exit.")
@@ -264,13 +265,13 @@ def start_value_iteration():
     display_all()
 
     cli.display("Starting Value Iteration...")
-    solver = Solver(GAME['level'])
-    policy = solver.solve_v_a(0.9, 0.000000000000000000000000000001)
+    solver = Solver(GAME['level'], criterion='span', max_sweeps=10000)
+    policy = solver.solve_v_a(0.9, 0.001)
     cli.add_status("Value iteration done.")
 
     GAME['user_loop'] = True
     while GAME['user_loop']:
-        GAME['level'].load(GAME['level'].name)
+        GAME['level'].restore()
         player = Player2(GAME['level'], HP=5)
         GAME['player'] = player
         cli.add_status("Press (space) to apply next move in policy.")
@@ -338,7 +339,7 @@ def start_policy_iteration():
 
     GAME['user_loop'] = True
     while GAME['user_loop']:
-        GAME['level'].load(GAME['level'].name)
+        GAME['level'].restore()
         player = Player2(GAME['level'], HP=5)
         GAME['player'] = player
         cli.add_status("Press (space) to apply next move in policy.")
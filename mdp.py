@@ -0,0 +1,258 @@
+import numpy as np
+from scipy import sparse
+
+import game
+
+# actions in the order used by the solvers and game.MOVES: u, d, r, l
+ACTIONS = ('u', 'd', 'r', 'l')
+
+# reward of an action that runs into a wall or out of the grid
+BLOCKED = -10000
+
+
+class Model:
+    """Transition model of a level for one inventory state.
+
+    The value of an action `a` in state `s` is
+    R[a][s] + gamma * (P[a][s] . V + H[a][s] * (portal . V) + L[a][s]).
+
+    Portals send the player to any state, so instead of dense rows of P the
+    moves into a portal go through a single hub whose value, `portal . V`,
+    is computed once per backup.
+
+    Attributes:
+        index (ndarray): (nbLine, nbCol) state index of each cell, -1 for walls
+            and the cells that cannot be reached from the start.
+        cells (ndarray): Flat grid position (y * nbCol + x) of each state.
+        start (int): State index of the starting position.
+        P (list): One (n, n) csr_matrix per action, probability of ending in
+            each state after the move and the reaction of the reached cell.
+        R (ndarray): (4, n) reward of each action.
+        L (ndarray): (4, n) expected value of the outcomes that end the game
+            or hurt the player (deaths and damage) for each action.
+        H (ndarray): (4, n) probability of going through a portal for each
+            action.
+        portal (ndarray): (n,) probability of landing on each state when going
+            through a portal, the landings on cracks are counted in L.
+    """
+
+    def __init__(self, index, cells, start, P, R, L, H, portal):
+        self.index = index
+        self.cells = cells
+        self.start = start
+        self.P = P
+        self.R = R
+        self.L = L
+        self.H = H
+        self.portal = portal
+        self._stacked = None
+        self._predecessors = None
+
+    @property
+    def n(self):
+        return len(self.cells)
+
+    def backup(self, v, gamma):
+        """Returns the (4, n) action values for the state values `v`."""
+        extended = np.empty(self.n + 2)
+        extended[:self.n] = v
+        extended[self.n] = 1.0
+        extended[self.n + 1] = self.portal.dot(v)
+        q = self.stacked(gamma).dot(extended).reshape(len(ACTIONS), self.n)
+        q += self.R
+        return q
+
+    def stacked(self, gamma):
+        """Returns the (4n, n + 2) csr_matrix gamma * [P[a] | L[a] | H[a]] of
+        the actions stacked on top of each other, so that a backup is a single
+        product with (V, 1, portal . V). The matrix of the last gamma is
+        cached."""
+        if self._stacked is None or self._stacked[0] != gamma:
+            blocks = [[self.P[a], sparse.csr_matrix(self.L[a][:, None]), sparse.csr_matrix(self.H[a][:, None])]
+                      for a in range(len(ACTIONS))]
+            self._stacked = (gamma, (gamma * sparse.bmat(blocks, format='csr')).tocsr())
+        return self._stacked[1]
+
+    def predecessors(self):
+        """Returns the reverse transition index of the model, computed once.
+
+        Returns:
+            (csr_matrix, ndarray, ndarray) the (n, n) matrix whose row s holds
+            the states that can move to s, with their highest probability of
+            doing so over the actions, then the states that can go through a
+            portal and their highest probability of doing so. The latter
+            depend on every landing state through the hub.
+        """
+        if self._predecessors is None:
+            forward = self.P[0]
+            for a in range(1, len(ACTIONS)):
+                forward = forward.maximum(self.P[a])
+            through = self.H.max(axis=0)
+            hub_states = np.flatnonzero(through)
+            self._predecessors = (forward.T.tocsr(), hub_states, through[hub_states])
+        return self._predecessors
+
+    def state_values(self, grid):
+        """Returns the (n,) values of the states from a (nbLine, nbCol) array."""
+        return np.asarray(grid, dtype=float).ravel()[self.cells]
+
+    def grid_values(self, v, fill=0.0):
+        """Returns the (nbLine, nbCol) array of the state values `v`, `fill`
+        on the cells that are not states."""
+        grid = np.full(self.index.size, fill)
+        grid[self.cells] = v
+        return grid.reshape(self.index.shape)
+
+    def policy(self, q):
+        """Returns the greedy policy of the action values `q` as a list of
+        lines of 'u', 'd', 'r', 'l' characters, the cells that are not
+        states are set to 'u'."""
+        best = np.zeros(self.index.size, dtype=int)
+        best[self.cells] = np.argmax(q, axis=0)
+        best = best.reshape(self.index.shape)
+        return [[ACTIONS[i] for i in line] for line in best.tolist()]
+
+
+def compile_model(level, r, has_sword=False, critical=False, damage=-2, dead=-500):
+    """Compiles the tile rules of `level` into a Model. Models are cached on the
+    level, compiling the same inventory state twice is free.
+
+    Args:
+        level (Level): Level to compile.
+        r (dict): Reward of stepping on each tile type.
+        has_sword (bool): Whether enemies are killed instantly.
+        critical (bool): Whether losing a life means death.
+        damage (float): Value of losing a life when not critical.
+        dead (float): Value of dying.
+
+    Returns:
+        (Model) the compiled model.
+    """
+    key = (tuple(sorted(r.items())), has_sword, critical, damage, dead)
+    if key not in level.models:
+        level.models[key] = _compile(level, r, has_sword, critical, damage, dead)
+    return level.models[key]
+
+
+def cell_rules(tiles, has_sword=False, critical=False, damage=-2, dead=-500):
+    """Returns the reaction of stepping on each cell as (stay, back, lost)
+    arrays shaped like `tiles`: the probability of staying on the cell, of
+    being sent back to the start, and the expected value of the outcomes that
+    end the game or hurt the player. Portals and moving platforms move the
+    player elsewhere, they are left as plain cells here, see _compile.
+
+    Args:
+        tiles (ndarray): Tile codes.
+        has_sword (bool): Whether enemies are killed instantly.
+        critical (bool): Whether losing a life means death.
+        damage (float): Value of losing a life when not critical.
+        dead (float): Value of dying.
+    """
+    loose = dead if critical else damage
+    stay = np.ones(tiles.shape)
+    back = np.zeros(tiles.shape)
+    lost = np.zeros(tiles.shape)
+    if not has_sword:
+        enemy = tiles == game.ENEMY
+        stay[enemy] = 0.7
+        lost[enemy] = 0.3 * loose
+    trap = tiles == game.TRAP
+    stay[trap] = 0.6
+    back[trap] = 0.3
+    lost[trap] = 0.1 * loose
+    crack = tiles == game.CRACK
+    stay[crack] = 0.0
+    lost[crack] = dead
+    return stay, back, lost
+
+
+def platform_moves(level):
+    """Returns where the moving platforms of `level` push the player, from
+    Level.platform_exits.
+
+    Returns:
+        (ndarray, csr_matrix, ndarray) the flat positions of the platforms,
+        the (nb_platforms, nbLine * nbCol) matrix of the probability of being
+        pushed on each cell, and the probability of being pushed into a
+        crack. A platform without exit keeps the player on it.
+    """
+    cells = np.array(sorted(level.platform_exits), dtype=np.int64)
+    tiles = level.tiles.ravel()
+    rows, cols, vals = [], [], []
+    cracked = np.zeros(len(cells))
+    for i, cell in enumerate(cells.tolist()):
+        exits = [c for _, c in level.platform_exits[cell]] or [cell]
+        for c in exits:
+            if tiles[c] == game.CRACK:
+                cracked[i] += 1.0 / len(exits)
+            else:
+                rows.append(i)
+                cols.append(c)
+                vals.append(1.0 / len(exits))
+    moves = sparse.csr_matrix((vals, (rows, cols)), shape=(len(cells), tiles.size))
+    return cells, moves, cracked
+
+
+def _compile(level, r, has_sword, critical, damage, dead):
+    # the states are the cells that can be reached from the start, the
+    # neighbours of a state are states too except around cracks
+    cells = np.flatnonzero(level.reachable())
+    n = len(cells)
+    rank = np.full(level.tiles.size, -1, dtype=np.int64)
+    rank[cells] = np.arange(n)
+    index = rank.reshape(level.tiles.shape)
+    tiles = level.tiles.ravel()[cells]
+    start = index[level.nbLine - 1, level.nbCol - 1]
+
+    # neighbour state of every state for each action, -1 when blocked
+    neighbours = level.next_cell[cells].T
+    neighbours = np.where(neighbours >= 0, rank[neighbours], -1)
+
+    # distribution over the states reached when stepping on each state
+    rows, cols, vals = [], [], []
+
+    def add(r_, c_, v_):
+        rows.append(r_)
+        cols.append(c_)
+        vals.append(np.broadcast_to(np.asarray(v_, dtype=float), np.shape(r_)))
+
+    stay, back, entry_l = cell_rules(tiles, has_sword, critical, damage, dead)
+    local = np.flatnonzero((tiles != game.PORTAL) & (tiles != game.PLATFORM) & (stay > 0))
+    add(local, local, stay[local])
+    sent = np.flatnonzero(back)
+    add(sent, np.full(len(sent), start), back[sent])
+
+    platform = np.flatnonzero(tiles == game.PLATFORM)
+    exits = neighbours[:, platform]
+    nb_exits = (exits >= 0).sum(axis=0)
+    for d in range(len(ACTIONS)):
+        ok = exits[d] >= 0
+        src, dst = platform[ok], exits[d][ok]
+        crack = tiles[dst] == game.CRACK
+        add(src[~crack], dst[~crack], 1.0 / nb_exits[ok][~crack])
+        np.add.at(entry_l, src[crack], dead / nb_exits[ok][crack])
+    stuck = platform[nb_exits == 0]
+    add(stuck, stuck, 1.0)
+
+    # when a portal can be reached every free cell is a state
+    portal = tiles == game.PORTAL
+    entry_h = portal.astype(float)
+    landing = np.where(tiles != game.CRACK, 1.0 / n, 0.0) if portal.any() else np.zeros(n)
+    entry_l[portal] = dead * (tiles == game.CRACK).sum() / n
+
+    entry = sparse.csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n, n))
+    entry_r = np.array([r[c] for c in game.TILES], dtype=float)[tiles]
+
+    P, R = [], np.full((len(ACTIONS), n), float(BLOCKED))
+    L, H = np.zeros((len(ACTIONS), n)), np.zeros((len(ACTIONS), n))
+    for a in range(len(ACTIONS)):
+        ok = np.flatnonzero(neighbours[a] >= 0)
+        target = neighbours[a][ok]
+        select = sparse.csr_matrix((np.ones(len(ok)), (ok, target)), shape=(n, n))
+        P.append((select @ entry).tocsr())
+        R[a][ok] = entry_r[target]
+        L[a][ok] = entry_l[target]
+        H[a][ok] = entry_h[target]
+    return Model(index, cells, start, P, R, L, H, landing)
@@ -0,0 +1,72 @@
+import csv
+import time
+
+
+class MetricsSink:
+    """Receives the training progress records of QLearning.train."""
+
+    def __init__(self, interval=0):
+        """Initializes the sink.
+
+        Args:
+            interval (float): Minimum number of seconds between two records,
+                records reported sooner are dropped. 0 keeps every record.
+        """
+        self.interval = interval
+        self._last = None
+
+    def due(self):
+        """Returns True if a record reported now would be kept."""
+        now = time.monotonic()
+        if self._last is not None and now - self._last < self.interval:
+            return False
+        self._last = now
+        return True
+
+    def write(self, record):
+        """Stores a record, a dict of metric names and values."""
+        raise NotImplementedError()
+
+    def close(self):
+        """Releases the resources used by the sink."""
+        pass
+
+
+class MemorySink(MetricsSink):
+    """Keeps the records in the `records` list."""
+
+    def __init__(self, interval=0):
+        super().__init__(interval)
+        self.records = list()
+
+    def write(self, record):
+        self.records.append(record)
+
+
+class CsvSink(MetricsSink):
+    """Writes the records as the rows of a CSV file."""
+
+    def __init__(self, filename, interval=0):
+        super().__init__(interval)
+        self.file = open(filename, 'w', newline='')
+        self.writer = None
+
+    def write(self, record):
+        if self.writer is None:
+            self.writer = csv.DictWriter(self.file, fieldnames=list(record))
+            self.writer.writeheader()
+        self.writer.writerow(record)
+
+    def close(self):
+        self.file.close()
+
+
+class CallbackSink(MetricsSink):
+    """Calls a function with each record."""
+
+    def __init__(self, fn, interval=0):
+        super().__init__(interval)
+        self.fn = fn
+
+    def write(self, record):
+        self.fn(record)
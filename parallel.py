@@ -0,0 +1,21 @@
+from concurrent.futures import ProcessPoolExecutor
+
+
+def solve_states(solve, jobs, workers=1):
+    """Runs one independent solve per inventory state.
+
+    Args:
+        solve (callable): Solving function, must be picklable (a module level
+            function or a method of a picklable object) when `workers` > 1.
+        jobs (dict): Arguments of `solve` for each inventory state.
+        workers (int): Number of processes. 1 solves the states one after the
+            other in the current process, None uses one process per CPU.
+
+    Returns:
+        (dict) result of `solve` for each inventory state.
+    """
+    if workers == 1:
+        return {state: solve(*args) for state, args in jobs.items()}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {state: pool.submit(solve, *args) for state, args in jobs.items()}
+        return {state: future.result() for state, future in futures.items()}
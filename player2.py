@@ -4,6 +4,7 @@ import sys
 
 class Player2:
     def __init__(self, level, HP=3):
+        self.level = level
         self.grid = level.grid
         self.name = "player"
         self.x_pos = level.nbCol - 1
@@ -18,36 +19,25 @@ class Player2:
         self.prev_pos = [self.x_pos, self.y_pos]
 
     def move_up(self):
-        self.prev_pos = [self.x_pos, self.y_pos]
-        if self.y_pos - 1 >= 0:
-            if self.grid[self.y_pos-1][self.x_pos] != '_':
-                self.y_pos -= 1
-                return True
-        return False
+        return self.move(0)
 
     def move_down(self):
-        self.prev_pos = [self.x_pos, self.y_pos]
-        if self.y_pos + 1 < self.max_line:
-            if self.grid[self.y_pos+1][self.x_pos] != '_':
-                self.y_pos += 1
-                return True
-        return False
+        return self.move(1)
 
     def move_left(self):
-        self.prev_pos = [self.x_pos, self.y_pos]
-        if self.x_pos - 1 >= 0:
-            if self.grid[self.y_pos][self.x_pos-1] != '_':
-                self.x_pos -= 1
-                return True
-        return False
+        return self.move(3)
 
     def move_right(self):
+        return self.move(2)
+
+    def move(self, action):
+        # action in the order of game.MOVES: up, down, right, left
         self.prev_pos = [self.x_pos, self.y_pos]
-        if self.x_pos + 1 < self.max_col:
-            if self.grid[self.y_pos][self.x_pos+1] != '_':
-                self.x_pos += 1
-                return True
-        return False
+        cell = self.level.next_cell.item(self.y_pos * self.max_col + self.x_pos, action)
+        if cell < 0:
+            return False
+        self.y_pos, self.x_pos = divmod(cell, self.max_col)
+        return True
 
     def is_dead(self):
         return self.life <= 0
@@ -61,28 +51,29 @@ class Player2:
         )
 
     def grid_reaction(self):
-        if self.grid[self.y_pos][self.x_pos] == "K":  # key pickup
+        cell = self.grid[self.y_pos][self.x_pos]
+        if cell == "K":  # key pickup
             self.has_key = True
-            self.grid[self.y_pos][self.x_pos] = 'B'
-        elif self.grid[self.y_pos][self.x_pos] == "T":  # treasure pickup
+            self.level.consume(self.y_pos, self.x_pos)
+        elif cell == "T":  # treasure pickup
             if self.has_key:
                 self.has_treasure = True
-                self.grid[self.y_pos][self.x_pos] = 'B'
-        elif self.grid[self.y_pos][self.x_pos] == "S":  # game ending
+                self.level.consume(self.y_pos, self.x_pos)
+        elif cell == "S":  # game ending
             if self.has_treasure:
                 self.win = True
-        elif self.grid[self.y_pos][self.x_pos] == "E":  # fighting an enemy
+        elif cell == "E":  # fighting an enemy
             if not self.has_sword:
                 if random.uniform(0, 1) < 0.3:
                     self.life -= 1
             # self.grid[self.y_pos][self.x_pos] = 'B'
-        elif self.grid[self.y_pos][self.x_pos] == "C":  # falling into crack
+        elif cell == "C":  # falling into crack
             self.life -= 1
             return True, False
-        elif self.grid[self.y_pos][self.x_pos] == "W":  # sword pickup
+        elif cell == "W":  # sword pickup
             self.has_sword = True
-            self.grid[self.y_pos][self.x_pos] = 'B'
-        elif self.grid[self.y_pos][self.x_pos] == "R":  # trap
+            self.level.consume(self.y_pos, self.x_pos)
+        elif cell == "R":  # trap
             tmp = random.uniform(0, 1)
             if tmp <= 0.1:
                 self.life -= 1
@@ -91,38 +82,23 @@ class Player2:
                 self.x_pos = self.max_col - 1
                 self.y_pos = self.max_line - 1
                 return True, True
-        elif self.grid[self.y_pos][self.x_pos] == "P":  # teleport
-            self.x_pos = random.randint(0, self.max_col - 1)
-            self.y_pos = random.randint(0, self.max_line - 1)
-            while self.grid[self.y_pos][self.x_pos] == "_" or  \
-                    self.x_pos == self.prev_pos[0] and self.y_pos == self.prev_pos[1]:
-                self.x_pos = random.randint(0, self.max_col - 1)
-                self.y_pos = random.randint(0, self.max_line - 1)
+        elif cell == "P":  # teleport
+            # any free cell but the previous position
+            free_cells = self.level.free_cells
+            rank = random.randrange(len(free_cells) - 1)
+            if rank >= self.level.free_rank[self.prev_pos[1] * self.max_col + self.prev_pos[0]]:
+                rank += 1
+            self.y_pos, self.x_pos = divmod(int(free_cells[rank]), self.max_col)
             return True, True
-        elif self.grid[self.y_pos][self.x_pos] == "M":  # moving platform
-            moved = False
-            while not moved:
-                tmp = random.randint(0, 3)
-                if tmp == 0:
-                    if self.x_pos + 1 != self.max_col and self.x_pos + 1 != self.prev_pos[0] and \
-                            self.grid[self.y_pos][self.x_pos + 1] != "_":
-                        self.x_pos += 1
-                        moved = True
-                elif tmp == 1:
-                    if self.x_pos - 1 != -1 and self.x_pos - 1 != self.prev_pos[0]and \
-                            self.grid[self.y_pos][self.x_pos - 1] != "_":
-                        self.x_pos -= 1
-                        moved = True
-                elif tmp == 2:
-                    if self.y_pos + 1 != self.max_line and self.y_pos + 1 != self.prev_pos[1]and \
-                            self.grid[self.y_pos + 1][self.x_pos] != "_":
-                        self.y_pos += 1
-                        moved = True
-                else:
-                    if self.y_pos - 1 != -1 and self.y_pos - 1 != self.prev_pos[1]and \
-                            self.grid[self.y_pos - 1][self.x_pos] != "_":
-                        self.y_pos -= 1
-                        moved = True
+        elif cell == "M":  # moving platform
+            # any exit that does not go back to the line or column of the
+            # previous position
+            exits = [target for action, target in self.level.platform_exits[self.y_pos * self.max_col + self.x_pos]
+                     if action < 2 and target // self.max_col != self.prev_pos[1]
+                     or action >= 2 and target % self.max_col != self.prev_pos[0]]
+            if not exits:
+                return False, False
+            self.y_pos, self.x_pos = divmod(random.choice(exits), self.max_col)
             return True, True
 
         return False, False
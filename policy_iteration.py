@@ -1,39 +1,40 @@
 import numpy as np
-import copy
+from scipy import sparse
+from scipy.sparse.linalg import spsolve
+import functools
+import math
 import time
 
+import mdp
+import parallel
+
 def timer(f):
-    def wrapper(*args):
+    def wrapper(*args, **kwargs):
         t0=time.time()
-        res=f(*args)
+        res=f(*args, **kwargs)
         t='%.2f' % (time.time()-t0)
         print("Temps d'execution : ",t," secondes")
         return res
     return wrapper
 
 @timer
-def solve_p_i(gamma, level):
-    return {
-        (False, False, False, True): policy_iteration(gamma, level, get_reward(), True, False),
-        (False, True, False, True): policy_iteration(gamma, level, get_reward(has_sword=True), True, True),
-        (True, False, False, True): policy_iteration(gamma, level, get_reward(has_key=True), True),
-        (True, False, True, True): policy_iteration(gamma, level,
-                                                        get_reward(has_key=True, has_treasure=True), True),
-        (True, True, False, True): policy_iteration(gamma, level, get_reward(has_key=True, has_sword=True),
-                                                        True, True),
-        (True, True, True, True): policy_iteration(gamma, level,
-                                                       get_reward(has_key=True, has_sword=True, has_treasure=True),
-                                                       True, True),
-        (False, False, False, False): policy_iteration(gamma, level, get_reward(), False),
-        (False, True, False, False): policy_iteration(gamma, level, get_reward(has_sword=True), False, True),
-        (True, False, False, False): policy_iteration(gamma, level, get_reward(has_key=True), False),
-        (True, False, True, False): policy_iteration(gamma, level,
-                                                         get_reward(has_key=True, has_treasure=True), False),
-        (True, True, False, False): policy_iteration(gamma, level, get_reward(has_key=True, has_sword=True),
-                                                         False, True),
-        (True, True, True, False): policy_iteration(gamma, level, get_reward(has_key=True, has_sword=True,
-                                                                                        has_treasure=True), False, True)
-    }
+def solve_p_i(gamma, level, workers=1, k=math.inf):
+    return parallel.solve_states(functools.partial(policy_iteration, k=k), {
+        (False, False, False, True): (gamma, level, get_reward(), True, False),
+        (False, True, False, True): (gamma, level, get_reward(has_sword=True), True, True),
+        (True, False, False, True): (gamma, level, get_reward(has_key=True), True),
+        (True, False, True, True): (gamma, level, get_reward(has_key=True, has_treasure=True), True),
+        (True, True, False, True): (gamma, level, get_reward(has_key=True, has_sword=True), True, True),
+        (True, True, True, True): (gamma, level, get_reward(has_key=True, has_sword=True, has_treasure=True),
+                                   True, True),
+        (False, False, False, False): (gamma, level, get_reward(), False),
+        (False, True, False, False): (gamma, level, get_reward(has_sword=True), False, True),
+        (True, False, False, False): (gamma, level, get_reward(has_key=True), False),
+        (True, False, True, False): (gamma, level, get_reward(has_key=True, has_treasure=True), False),
+        (True, True, False, False): (gamma, level, get_reward(has_key=True, has_sword=True), False, True),
+        (True, True, True, False): (gamma, level, get_reward(has_key=True, has_sword=True, has_treasure=True),
+                                    False, True)
+    }, workers)
 
 
 def get_reward(has_key=False, has_sword=False, has_treasure=False):
@@ -75,195 +76,72 @@ def get_reward(has_key=False, has_sword=False, has_treasure=False):
     return reward
 
 
-def init_p_i(level, variables, p0):
-    for y in range(0, level.nbLine):
-        line = []
-        for x in range(0, level.nbCol):
-            if y == 0:
-                line.append('d')
-            else:
-                line.append('u')
-            variables.append(str(y) + str(x))
-        p0.append(line)
-
-
-def set_variables(level, y, x, eq, gamma, has_sword):
-    if level.grid[y][x] == 'R':
-        eq['dead'] = 0.1 * gamma
-        eq[str(level.nbCol - 1) + str(level.nbLine - 1)] = 0.3 * gamma
-        eq[str(y) + str(x)] = 0.6 * gamma
-    elif level.grid[y][x] == 'C':
-        eq['dead'] = -1
-    elif level.grid[y][x] == 'E':
-        eq[str(y) + str(x)] = 1 * gamma
-        if has_sword:
-            eq[str(y) + str(x)] = 1 * gamma
-        else:
-            eq[str(y) + str(x)] = 0.7 * gamma
-            eq['dead'] = 0.3 * gamma
-        return
-    else:
-        eq[str(y) + str(x)] = 1 * gamma
-
-
-def define_equations(y, x, dt, level, eq, rest, gamma, r, has_sword):
-    if level.grid[y][x] not in ('P','M','_'):
-        if dt[y][x] == 'u':
-            if y > 0 and level.grid[y - 1][x] != '_':
-                rest.append(r[level.grid[y - 1][x]] * -1)
-                set_variables(level,y - 1, x, eq, gamma,has_sword)
-            else:
-                rest.append(r[level.grid[y][x]] * -1)
-        elif dt[y][x] == 'd':
-            if y < level.nbLine - 1 and level.grid[y + 1][x] != '_':
-                rest.append(r[level.grid[y + 1][x]] * -1)
-                set_variables(level,y + 1, x, eq, gamma,has_sword)
-            else:
-                rest.append(r[level.grid[y][x]] * -1)
-        elif dt[y][x] == 'l':
-            if x > 0 and level.grid[y][x - 1] != '_':
-                rest.append(r[level.grid[y][x - 1]] * -1)
-                set_variables(level,y, x - 1, eq, gamma,has_sword)
-            else:
-                rest.append(r[level.grid[y][x]] * -1)
-        else:
-            if x < level.nbCol - 1 and level.grid[y][x + 1] != '_':
-                rest.append(r[level.grid[y][x + 1]] * -1)
-                set_variables(level,y, x + 1, eq, gamma,has_sword)
-            else:
-                rest.append(r[level.grid[y][x]] * -1)
-    else:
-        if level.grid[y][x] == 'P':
-            rest.append(0)
-            p = []
-            cpt = 0
-            nb_dead = 0
-            for y in range(0, level.nbLine):
-                for x in range(0, level.nbCol):
-                    if level.grid[y][x] != '_':
-                        p.append(str(y) + str(x))
-                        cpt += 1
-            eq['dead'] = nb_dead / cpt * gamma
-            for var in p:
-                if eq[var] != -1:
-                    eq[var] = 1 / cpt * gamma
-        if level.grid[y][x] == 'M':
-            rest.append(0)
-            cpt = 0
-            p = []
-            if y > 0:
-                if level.grid[y-1][x] != '_':
-                    cpt += 1
-                    p.append(str(y - 1) + str(x))
-            if y < level.nbLine - 1:
-                if level.grid[y+1][x] != '_':
-                    cpt += 1
-                    p.append(str(y + 1) + str(x))
-            if x > 0:
-                if level.grid[y][x-1] != '_':
-                    cpt += 1
-                    p.append(str(y) + str(x - 1))
-            if x < level.nbCol - 1:
-                if level.grid[y][x+1] != '_':
-                    cpt += 1
-                    p.append(str(y) + str(x + 1))
-            for num in p:
-                eq[num] = (1 / cpt) * gamma
-
-
-
-def build_dt1(level,ar,dt1):
-    cpt = 0
-    for y in range(0, level.nbLine):
-        line = []
-        for x in range(0, level.nbCol):
-            line.append(ar[cpt])
-            cpt += 1
-        dt1.append(line)
-
-
-def policy_iteration(gamma, level, r, crtical,has_sword=True):
-    a = ['u', 'd', 'l', 'r']
-    p0 = []
-    variables = []
-    init_p_i(level, variables, p0)
-    dt = copy.deepcopy(p0)
+def evaluation_system(model, policy, gamma):
+    """Returns the linear system of the evaluation of `policy`.
+
+    Variable s < n is the value of state s and variable n the portal hub,
+    portal . V, so that the moves into a portal refer to a single variable
+    and the system stays sparse.
+
+    Args:
+        model (mdp.Model): Compiled model of the level.
+        policy (ndarray): (n,) action of each state, in the order of
+            mdp.ACTIONS.
+        gamma (float): Discount factor.
+
+    Returns:
+        (csc_matrix, ndarray) the (n + 1, n + 1) matrix and the right hand
+        side of the system.
+    """
+    n = model.n
+    states = np.arange(n)
+    # gamma * [P | L | H] of the action of each state, see Model.stacked
+    rows = model.stacked(gamma)[policy * n + states]
+    a = sparse.bmat([[sparse.identity(n) - rows[:, :n], -rows[:, n + 1]],
+                     [-sparse.csr_matrix(model.portal[None, :]), sparse.identity(1)]], format='csc')
+    rest = np.append(model.R[policy, states] + rows[:, n].toarray().ravel(), 0.0)
+    return a, rest
+
+
+def evaluate(a, rest, v, k):
+    # exact solve, or k Bellman expectation sweeps warm-started from v
+    # (modified policy iteration)
+    if k == math.inf:
+        return spsolve(a, rest)
+    if v is None:
+        v = np.zeros(len(rest))
+    diagonal = a.diagonal()
+    a = (a - sparse.diags(diagonal)).tocsr()
+    for _ in range(k):
+        v = (rest - a.dot(v)) / diagonal
+    return v
+
+
+def policy_iteration(gamma, level, r, crtical, has_sword=True, k=math.inf, damage=-2, dead=-500):
+    model = mdp.compile_model(level, r, has_sword, crtical, damage, dead)
+    n = model.n
+    states = np.arange(n)
+    # down on the first line, up everywhere else
+    dt = np.where(model.cells < level.nbCol, mdp.ACTIONS.index('d'), mdp.ACTIONS.index('u'))
+    ar = None
     cpt = 0
     while cpt < 2000:
         cpt += 1
-        eqs = []
-        rest = []
-        ctn = False
-        for y in range(0, level.nbLine):
-            for x in range(0, level.nbCol):
-                eq = dict.fromkeys(variables, 0)
-                eq['dead'] = 0  # adding variable for death
-                if level.grid[y][x] != '_':
-                    eq[str(y) + str(x)] = -1  # see policy iterations equations
-                    define_equations(y, x, dt, level, eq, rest, gamma, r,has_sword)
-                    eqs.append(list(eq.values()))
-                else:
-                    eq[str(y) + str(x)] = 1
-                    rest.append(0)
-                    eqs.append(list(eq.values()))
-
-        # adding equation if U died
-        eqdeath = dict.fromkeys(variables, 0)
-        eqdeath[len(eqdeath) - 1] = 1
-        rest.append(500)
-        eqs.append(list(eqdeath.values()))
-        #print(eqs)
-        #print(rest)
-        ar = np.linalg.solve(eqs, rest)
-        dt1 = []
-        build_dt1(level, ar, dt1)
-        #TODO dead = ar[len(ar) - 1]
-        #TODO check if r is good or not
-        for y in range(0, level.nbLine):
-            for x in range(0, level.nbCol):
-                value = dict()
-                for act in a:
-                    if level.grid[y][x] not in ('P', 'M', '_'):
-                        if act == 'u':
-                            if y > 0:
-                                if level.grid[y - 1][x] != '_':
-                                    p1 = get_possible_move(y - 1, x, dt1, level,has_sword) * gamma + r[level.grid[y - 1][x]]
-                                    value[act] = p1
-                        elif act == 'd':
-                            if y < level.nbLine - 1:
-                                if level.grid[y + 1][x] != '_':
-                                    p1 = get_possible_move(y + 1, x, dt1,level,has_sword) * gamma + r[level.grid[y + 1][x]]
-                                    value[act] = p1
-                        elif act == 'l':
-                            if x > 0:
-                                if level.grid[y][x - 1] != '_':
-                                    p1 = get_possible_move(y, x - 1, dt1,level,has_sword) * gamma + r[level.grid[y][x - 1]]
-                                    value[act] = p1
-                        else:
-                            if x < level.nbCol - 1:
-                                if level.grid[y][x + 1] != '_':
-                                    p1 = get_possible_move(y, x + 1, dt1,level,has_sword) * gamma +  r[level.grid[y][x + 1]]
-                                    value[act] = p1
-                    else:
-                        value[act] = 0
-                update = max(value, key=value.get)
-                if dt[y][x] != update:
-                    ctn = True
-                dt[y][x] = update
-        #print("-----------------------------------------------------")
-        #for line in dt:
-        #    print(line)
-        if not ctn:
-            print(cpt)
-            return dt
+        a, rest = evaluation_system(model, dt, gamma)
+        ar = evaluate(a, rest, ar, k)
+        q = model.backup(ar[:n], gamma)
+        # the current action is kept on ties, gains within the rounding errors
+        # of the evaluation included, so that the iteration ends
+        update = q.argmax(axis=0)
+        best = q[update, states]
+        keep = q[dt, states] >= best - 1e-9 * np.abs(best)
+        update[keep] = dt[keep]
+        if (update == dt).all():
+            if k == math.inf:
+                break
+            # after k sweeps a stable policy is not necessarily optimal: the
+            # iteration goes on with exact evaluations from this policy
+            k = math.inf
+        dt = update
     print(cpt)
-    return dt
-
-
-def get_possible_move(y, x, dt1, level,has_sword):
-    return dt1[y][x]
-
-
-
-
-
+    return model.policy(np.eye(len(mdp.ACTIONS))[dt].T)
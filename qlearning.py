@@ -1,6 +1,6 @@
 import math
+import numpy as np
 from random import choice, uniform
-from copy import copy
 from enum import Enum
 
 from game import Level
@@ -72,7 +72,7 @@ class QLearning:
 
     def __init__(self, level, cli=None, default_q=10,
                  alpha=0.1, gamma=0.9, epsilon=0.01, eps_strategy='constant',
-                 player_health=1):
+                 player_health=1, q_backend='dict'):
         """Initializes algorithm parameters.
 
         Args:
@@ -89,6 +89,11 @@ class QLearning:
                 the learning process.
             player_health (int): Number used to initialize player objects when
                 training.
+            q_backend (string): Storage of the Q table. If 'dict', Q values
+                are stored in a dict keyed by player states. If 'array', they
+                are stored in a preallocated numpy array indexed by
+                (y, x, has_key, has_sword, has_treasure, critical), padded by
+                one cell on each side for the moves out of the grid.
         Raises:
             ValueError: If an argument has an unexpected value.
         """
@@ -96,13 +101,24 @@ class QLearning:
         # Environment parameters
         self.level = level
         self.level_name = level.name
-        self.grid = copy(level.grid)
+        self.grid = level.grid
         self.player = None
         self.player_health = player_health
         self.cli = cli
 
         # Algorithm parameters
-        self.Q = dict()
+        if q_backend == 'dict':
+            self.Q = dict()
+        elif q_backend == 'array':
+            self.Q = np.full((level.nbLine + 2, level.nbCol + 2, 2, 2, 2, 2),
+                             default_q, dtype=float)
+            # Flat view of the table and strides of the x and y axes in it.
+            self._q_flat = self.Q.reshape(-1)
+            self._x_stride = 16
+            self._y_stride = 16 * (level.nbCol + 2)
+        else:
+            raise ValueError("Invalid Q backend: {}".format(q_backend))
+        self.q_backend = q_backend
         self.default_q = default_q
         if alpha > 1 or alpha < 0:
             raise ValueError("Learning rate 'alpha' must be between 0 and 1.")
@@ -260,6 +276,8 @@ class QLearning:
         """
         if origin_state is None:
             origin_state = self.get_state()
+        if self.q_backend == 'array':
+            return self._get_max_next_q_array(origin_state, no_random)
         q_values = {
             DIRECTION.UP: self.Q.get(
                 self.get_state(state=origin_state, direction=DIRECTION.UP),
@@ -293,6 +311,42 @@ class QLearning:
 
         return choice(maximums)
 
+    def _index(self, state):
+        """Returns the position of a player state in the flat Q table."""
+        x, y, has_key, has_sword, has_treasure, critical = state
+        return (y + 1) * self._y_stride + (x + 1) * self._x_stride + \
+            8 * has_key + 4 * has_sword + 2 * has_treasure + critical
+
+    def _get_max_next_q_array(self, origin_state, no_random):
+        """Array backend of `get_max_next_q`."""
+        q = self._q_flat
+        i = self._index(origin_state)
+        up = q[i - self._y_stride]
+        down = q[i + self._y_stride]
+        left = q[i - self._x_stride]
+        right = q[i + self._x_stride]
+        max_value = max(up, down, left, right)
+
+        if no_random:
+            if up == max_value:
+                return DIRECTION.UP, up
+            if down == max_value:
+                return DIRECTION.DOWN, down
+            if left == max_value:
+                return DIRECTION.LEFT, left
+            return DIRECTION.RIGHT, right
+
+        return choice([(direction, value) for direction, value in (
+            (DIRECTION.UP, up), (DIRECTION.DOWN, down),
+            (DIRECTION.LEFT, left), (DIRECTION.RIGHT, right)
+        ) if value == max_value])
+
+    def get_q(self, state):
+        """Returns the Q value of a player state."""
+        if self.q_backend == 'array':
+            return self._q_flat[self._index(state)]
+        return self.Q.get(state, self.default_q)
+
     def display_q(self):
         """Displays the Q table for the current player state."""
         for y in range(self.level.nbLine):
@@ -301,18 +355,18 @@ class QLearning:
                     color = 'red'
                 else:
                     color = 'default'
-                self.cli.display("[{:.2f}]".format(self.Q.get(
+                self.cli.display("[{:.2f}]".format(self.get_q(
                         (x, y, self.player.has_key, self.player.has_sword,
-                         self.player.has_treasure, self.player.life <= 1),
-                        self.default_q)
+                         self.player.has_treasure, self.player.life <= 1))
                     ),
                     end="", color=color)
             self.cli.display()
 
     def reset(self):
-        """Resets the player and level objects used by the algorithm."""
+        """Resets the player and level objects used by the algorithm. Every
+        object picked up, before the training too, is put back."""
+        self.level.restore()
         self.player = Player2(self.level, HP=self.player_health)
-        self.level.load(self.level_name)
 
     @property
     def epsilon(self):
@@ -332,6 +386,11 @@ class QLearning:
             reward (float): Reward value for reaching `state`.
             max_q_next_action (float): Maximum next reward value at state.
         """
+        if self.q_backend == 'array':
+            i = self._index(state)
+            self._q_flat[i] += self._alpha * (reward + self._gamma
+                                              * max_q_next_action - self._q_flat[i])
+            return
         self.Q[state] = self.Q.get(state, self.default_q)
         self.Q[state] += self._alpha * (reward + self._gamma
                                         * max_q_next_action - self.Q[state])
@@ -368,15 +427,20 @@ class QLearning:
 
         return reward
 
-    def train(self):
+    def train(self, metrics=None):
         """Trains the player on the level. The algorithm uses an epsilon-greedy
         strategy to avoid local optimums. The next move is thus the move that
         maximises the expected reward with (1-epsilon) probability and a random
         move with epsilon probability.
+
+        Training is headless when the algorithm has no command line interface.
+
+        Args:
+            metrics (MetricsSink): Receives a progress record every 10
+                iterations. See metrics.py.
         """
         wins = [1, 0]
         total_wins = 0
-        win_ratios = list([0])
         self.iter = 0
         self._epsilon = self._o_epsilon
         interactive = False
@@ -393,7 +457,7 @@ class QLearning:
             self.iter += 1
 
             # Display every 10 iterations.
-            if self.iter % 10 == 0:
+            if self.iter % 10 == 0 and self.cli is not None:
                 self.cli.clear()
                 self.log("ε = {:.3f}, α = {:.2f}, γ = {:.2f}"
                          .format(self.epsilon, self._alpha, self._gamma))
@@ -403,11 +467,18 @@ class QLearning:
                 self.log("Number of iterations since last ε increase: {}".format(
                     self.iter - self.iter_at_lift
                 ))
-                ratio = sum(wins)/len(wins)
                 self.log("Victory percentage over last 1,000 episodes: {:.1%}".format(
-                    ratio
+                    sum(wins)/len(wins)
                 ))
-                win_ratios.append(ratio)
+            if self.iter % 10 == 0 and metrics is not None and metrics.due():
+                metrics.write({
+                    'iteration': self.iter,
+                    'epsilon': self._epsilon,
+                    'wins': total_wins,
+                    'win_percentage': total_wins / self.iter,
+                    'recent_win_percentage': sum(wins) / len(wins),
+                    'since_epsilon_increase': self.iter - self.iter_at_lift,
+                })
             self.reset()
 
             self.time = 0
@@ -490,11 +561,6 @@ class QLearning:
             if len(wins) > 1000:
                 wins.pop(0)
 
-        with open('log', 'w') as f:
-            i = 0
-            for r in win_ratios:
-                f.write("{}, {}\n".format(i * 10, r))
-                i += 1
         return {
             'win_percentage': total_wins / self.iter,
             'wins': total_wins,
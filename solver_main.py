@@ -5,8 +5,8 @@ import policy_iteration
 game = game.Level()
 game.load("instances/lvl-n8-2")
 game.display()
-sol = value_iteration.Solver(game)
-#policy = sol.solve_v_a(0.5, 0.000000000000000000000000000000000001)
+sol = value_iteration.Solver(game, criterion='span')
+#policy = sol.solve_v_a(0.5, 0.001)
 policy = policy_iteration.solve_p_i(0.99,game)
 #game.display_policy(policy)
 game.visualize(policy)
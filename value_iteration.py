@@ -1,19 +1,136 @@
-import copy
+import heapq
+import itertools
 import time
 
+import numpy as np
+
+import game
+import mdp
+import parallel
+
 def timer(f):
-    def wrapper(*args):
+    def wrapper(*args, **kwargs):
         t0=time.time()
-        res=f(*args)
+        res=f(*args, **kwargs)
         t='%.2f' % (time.time()-t0)
         print("Temps d'execution : ",t," secondes")
         return res
     return wrapper
 
 
+def state_rows(model, gamma):
+    """Returns the rows of model.stacked(gamma) ordered by state, rows 4 * s
+    to 4 * s + 3 are the actions of state s, as (indptr, columns,
+    coefficients) lists for the loops backing up one state at a time."""
+    n = model.n
+    rows = model.stacked(gamma)[(np.arange(len(mdp.ACTIONS)) * n + np.arange(n)[:, None]).ravel()]
+    return rows.indptr.tolist(), rows.indices.tolist(), rows.data.tolist()
+
+
+class Stopping:
+    """Stopping rule of a value iteration.
+
+    Every criterion stops once the largest change of a value during a sweep
+    is below epsilon, except 'span' which stops once gamma / (1 - gamma)
+    times the span (largest minus smallest) of the changes is below epsilon,
+    which makes the greedy policy epsilon-optimal. 'policy' also stops once
+    the greedy policy has not changed for `stable_sweeps` sweeps. Whatever
+    the criterion, the iteration stops after `max_sweeps` sweeps or
+    `time_limit` seconds and returns the greedy policy of its current values,
+    `converged` tells which of both happened.
+    """
+
+    def __init__(self, criterion='delta', stable_sweeps=10, max_sweeps=None, time_limit=None):
+        if criterion not in ('delta', 'span', 'policy'):
+            raise ValueError("Invalid criterion: {}".format(criterion))
+        self.criterion = criterion
+        self.stable_sweeps = stable_sweeps
+        self.max_sweeps = max_sweeps
+        self.time_limit = time_limit
+        self.converged = True
+        self._started = 0.0
+        self._greedy = None
+        self._stable = 0
+
+    def start(self):
+        """Starts the budget and the policy stability count of a value
+        iteration."""
+        self.converged = True
+        self._started = time.time()
+        self._greedy = None
+        self._stable = 0
+
+    def out_of_budget(self, sweeps):
+        """Returns whether `sweeps` sweeps exhaust max_sweeps or time_limit,
+        in which case the value iteration is marked as not converged."""
+        if (self.max_sweeps is not None and sweeps >= self.max_sweeps
+                or self.time_limit is not None and time.time() - self._started >= self.time_limit):
+            self.converged = False
+        return not self.converged
+
+    def done(self, sweeps, low, high, epsilon, gamma, greedy):
+        """Returns whether a value iteration stops after a sweep.
+
+        Args:
+            sweeps (int): Number of sweeps so far.
+            low (float): Smallest change of a value during the sweep.
+            high (float): Largest change of a value during the sweep.
+            epsilon (float): Stopping threshold.
+            gamma (float): Discount factor.
+            greedy (callable): Returns the greedy actions of the current
+                values, only called by the 'policy' criterion.
+        """
+        if self.criterion == 'span':
+            if gamma / (1 - gamma) * (high - low) < epsilon:
+                return True
+        elif max(high, -low) < epsilon:
+            return True
+        if self.criterion == 'policy':
+            actions = greedy()
+            if self._greedy is not None and np.array_equal(actions, self._greedy):
+                self._stable += 1
+            else:
+                self._stable = 0
+            self._greedy = actions
+            if self._stable >= self.stable_sweeps:
+                return True
+        return self.out_of_budget(sweeps)
+
+
 class Solver:
-    def __init__(self, level):
+    def __init__(self, level, engine='python', order=None, criterion='delta', stable_sweeps=10,
+                 max_sweeps=None, time_limit=None):
         self.level = level
+        # 'python' backs up the states of the model compiled by mdp one at a
+        # time, 'numpy' backs up every cell at once on (nbLine, nbCol, 4)
+        # arrays with the same rules, 'sparse' backs up the states of the
+        # model with sparse matrix products, 'prioritized' backs them up one
+        # at a time by priority
+        if engine not in ('python', 'numpy', 'sparse', 'prioritized'):
+            raise ValueError("Invalid engine: {}".format(engine))
+        # None backs up the cells of the python engine from the values of
+        # the previous sweep (Jacobi), the other orders update the values in
+        # place (Gauss-Seidel) in row-major order, in reverse row-major
+        # order, alternating both, or by BFS distance to the goal
+        if order not in (None, 'row', 'reverse', 'alternating', 'bfs'):
+            raise ValueError("Invalid order: {}".format(order))
+        if order is not None and engine != 'python':
+            raise ValueError("Orders are only supported by the python engine")
+        # the value iterations stop according to `stopping`, see Stopping
+        if criterion != 'delta' and engine == 'prioritized':
+            raise ValueError("The prioritized engine only supports the delta criterion")
+        self.engine = engine
+        self.order = order
+        self.stopping = Stopping(criterion, stable_sweeps, max_sweeps, time_limit)
+        # number of sweeps of the last value iteration, and of single state
+        # backups of the last prioritized sweeping
+        self.sweeps = 0
+        self.backups = 0
+        # (nbLine, nbCol) values of the last value iteration, and the values
+        # and number of sweeps of each inventory state of the last solve_v_a
+        self.v = None
+        self.state_values = {}
+        self.state_sweeps = {}
         self.damage = -2
         self.objective = 1000
         self.has_sword = False
@@ -73,64 +190,367 @@ class Solver:
             v.append([[0, 0]]*self.level.nbCol)
         return v
 
+    @property
+    def converged(self):
+        """Whether the last value iteration met its stopping criterion rather
+        than running out of budget."""
+        return self.stopping.converged
+
+    def state_jobs(self, gamma, epsilon):
+        """Returns the value_iteration arguments of each inventory state
+        (has_key, has_sword, has_treasure, critical)."""
+        jobs = {}
+        for has_key, has_sword, has_treasure, critical in itertools.product((False, True), repeat=4):
+            if has_treasure and not has_key:
+                continue
+            r = self.get_reward(has_key=has_key, has_sword=has_sword, has_treasure=has_treasure)
+            jobs[(has_key, has_sword, has_treasure, critical)] = (gamma, epsilon, r, critical, has_sword)
+        return jobs
+
     @timer
-    def solve_v_a(self, gamma, epsilon):
-        return {
-            (False, False, False, True): self.value_iteration(gamma, epsilon, self.get_reward(), True, False),
-            (False, True, False, True): self.value_iteration(gamma, epsilon, self.get_reward(has_sword=True), True, True),
-            (True, False, False, True): self.value_iteration(gamma, epsilon, self.get_reward(has_key=True), True),
-            (True, False, True, True): self.value_iteration(gamma, epsilon, self.get_reward(has_key=True, has_treasure=True), True),
-            (True, True, False, True): self.value_iteration(gamma, epsilon, self.get_reward(has_key=True, has_sword=True), True, True),
-            (True, True, True, True): self.value_iteration(gamma, epsilon, self.get_reward(has_key=True, has_sword=True,has_treasure=True), True, True),
-            (False, False, False, False): self.value_iteration(gamma, epsilon, self.get_reward(), False),
-            (False, True, False, False):  self.value_iteration(gamma, epsilon, self.get_reward(has_sword=True), False, True),
-            (True, False, False, False):  self.value_iteration(gamma, epsilon, self.get_reward(has_key=True), False),
-            (True, False, True, False):  self.value_iteration(gamma, epsilon, self.get_reward(has_key=True, has_treasure=True), False),
-            (True, True, False, False):  self.value_iteration(gamma, epsilon, self.get_reward(has_key=True, has_sword=True), False, True),
-            (True, True, True, False):  self.value_iteration(gamma, epsilon, self.get_reward(has_key=True, has_sword=True,has_treasure=True), False, True)
-        }
+    def solve_v_a(self, gamma, epsilon, workers=1, first=None, values=None):
+        """Solves every inventory state.
+
+        By default every state starts from zero values. With `first`, that
+        state is solved first, then the states that differ from a solved state
+        by one flag, each starting from the values of that state. The states
+        at the same distance from `first` are solved together.
+
+        Args:
+            gamma (float): Discount factor.
+            epsilon (float): Stopping threshold of value_iteration.
+            workers (int): Number of processes, see parallel.solve_states.
+            first (tuple): Inventory state solved first, None to solve the
+                states independently.
+            values (dict): Initial (nbLine, nbCol) values of some states, for
+                instance the `state_values` of a solve with another gamma.
+                They take precedence over the values of the neighbour states.
+
+        Returns:
+            (dict) policy of each inventory state. The values and the number
+            of sweeps of each state are kept in `state_values` and
+            `state_sweeps`, see solve_state.
+        """
+        jobs = self.state_jobs(gamma, epsilon)
+        values = values or {}
+        if first is None:
+            layers, parent = [list(jobs)], {}
+        else:
+            if first not in jobs:
+                raise ValueError("Invalid state: {}".format(first))
+            layers, parent = [[first]], {first: None}
+            while len(parent) < len(jobs):
+                layer = []
+                for state in layers[-1]:
+                    for other in jobs:
+                        if other not in parent and sum(a != b for a, b in zip(state, other)) == 1:
+                            parent[other] = state
+                            layer.append(other)
+                layers.append(layer)
+
+        results = {}
+        for layer in layers:
+            seeded = {}
+            for state in layer:
+                v0 = values.get(state)
+                if v0 is None and parent.get(state) is not None:
+                    v0 = results[parent[state]][1]
+                seeded[state] = jobs[state] + (v0,)
+            results.update(parallel.solve_states(self.solve_state, seeded, workers))
+        self.state_values = {state: result[1] for state, result in results.items()}
+        self.state_sweeps = {state: result[2] for state, result in results.items()}
+        return {state: results[state][0] for state in jobs}
+
+    def solve_state(self, gamma, epsilon, r, critcal, has_sword=False, v0=None):
+        """Runs value_iteration and returns the policy, the (nbLine, nbCol)
+        values and the number of sweeps (of single state backups for the
+        prioritized engine), so that they come back from the worker processes
+        too."""
+        policy = self.value_iteration(gamma, epsilon, r, critcal, has_sword, v0)
+        return policy, self.v, self.backups if self.engine == 'prioritized' else self.sweeps
+
+    def value_iteration(self, gamma, epsilon, r, critcal, has_sword=False, v0=None):
+        # v0 is the (nbLine, nbCol) array of initial values, zeros when None
+        if self.engine == 'numpy':
+            return self.value_iteration_np(gamma, epsilon, r, critcal, has_sword, v0)
+        if self.engine == 'sparse':
+            return self.value_iteration_sparse(gamma, epsilon, r, critcal, has_sword, v0)
+        if self.engine == 'prioritized':
+            return self.prioritized_sweeping(gamma, epsilon, r, critcal, has_sword, v0)
+        # the states of the model are backed up one at a time from the rows
+        # of Model.stacked
+        self.has_sword = has_sword
+        model = mdp.compile_model(self.level, r, has_sword, critcal, self.damage, self.dead)
+        n = model.n
+        indptr, columns, coefficients = state_rows(model, gamma)
+        rewards = model.R.T.tolist()
+        landing = model.portal.tolist()
+        index = model.index.tolist()
+        states = [index[y][x] for y, x in self.sweep_cells(r) if index[y][x] >= 0]
+        v = np.zeros(n) if v0 is None else model.state_values(v0)
+        extended = v.tolist() + [1.0, model.portal.dot(v)]
+        q = [list(reward) for reward in rewards]
+        self.sweeps = 0
+        self.stopping.start()
+        while True:
+            # in place, the moves read the values updated during this sweep
+            # and the portal hub follows them
+            prev = extended if self.order else list(extended)
+            low, high = np.inf, -np.inf
+            if self.order == 'alternating' and self.sweeps % 2:
+                order = reversed(states)
+            else:
+                order = states
+            self.sweeps += 1
+            for s in order:
+                qs = list(rewards[s])
+                row = len(mdp.ACTIONS) * s
+                for a in range(len(mdp.ACTIONS)):
+                    for i in range(indptr[row + a], indptr[row + a + 1]):
+                        qs[a] += coefficients[i] * prev[columns[i]]
+                value = max(qs)
+                change = value - extended[s]
+                low, high = min(low, change), max(high, change)
+                if self.order and landing[s]:
+                    extended[n + 1] += landing[s] * change
+                extended[s] = value
+                q[s] = qs
+            if not self.order:
+                extended[n + 1] = model.portal.dot(extended[:n])
+            if self.stopping.done(self.sweeps, low, high, epsilon, gamma, lambda: np.argmax(q, axis=1)):
+                self.v = model.grid_values(extended[:n])
+                return model.policy(np.array(q).T)
+
+    def sweep_cells(self, r):
+        """Returns the (y, x) cells in the order of the first sweep."""
+        cells = [(y, x) for y in range(self.level.nbLine) for x in range(self.level.nbCol)]
+        if self.order == 'reverse':
+            cells.reverse()
+        elif self.order == 'bfs':
+            distance = self.goal_distance(r)
+            cells.sort(key=lambda cell: distance[cell])
+        return cells
 
-    def value_iteration(self, gamma, epsilon, r, critcal, has_sword=False):
+    def goal_distance(self, r):
+        """Returns the (nbLine, nbCol) BFS distance of each cell to the cells
+        of highest reward, inf for the walls and the unreachable cells."""
+        tiles = self.level.tiles.ravel()
+        reward = np.array([r[c] for c in game.TILES], dtype=float)[tiles]
+        free = tiles != game.WALL
+        distance = np.full(tiles.size, np.inf)
+        frontier = np.flatnonzero(free & (reward == reward[free].max()))
+        depth = 0
+        while len(frontier):
+            distance[frontier] = depth
+            depth += 1
+            reached = self.level.next_cell[frontier].ravel()
+            reached = np.unique(reached[reached >= 0])
+            frontier = reached[distance[reached] == np.inf]
+        return distance.reshape(self.level.tiles.shape)
+
+    def value_iteration_np(self, gamma, epsilon, r, critcal, has_sword=False, v0=None):
         self.has_sword = has_sword
-        a = ['u', 'd', 'r', 'l']
-        v = self.buit_states()
+        grid = self.level.tiles
+        wall = grid == game.WALL
+        crack = grid == game.CRACK
+        portal = grid == game.PORTAL
+        landing = ~wall & ~crack
+        nb_open = (~wall).sum()
+        rew = np.array([r[c] for c in game.TILES], dtype=float)[grid]
+
+        # value of stepping on a cell is coef * max(q) + back * (value of the
+        # start) + lost, see mdp.cell_rules, except for portals, which lead to
+        # any cell that is not a wall, and moving platforms, see
+        # mdp.platform_moves. These are the rules of mdp.compile_model
+        coef, back, lost = mdp.cell_rules(grid, has_sword, critcal, self.damage, self.dead)
+        const = np.empty(grid.shape)
+        platforms, moves, cracked = mdp.platform_moves(self.level)
+        py, px = np.divmod(platforms, self.level.nbCol)
+
+        # entry is padded with walls so that every action is a shifted view
+        entry = np.full((self.level.nbLine + 2, self.level.nbCol + 2), -10000.0)
+        inner = entry[1:-1, 1:-1]
+        shifted = (entry[:-2, 1:-1], entry[2:, 1:-1], entry[1:-1, 2:], entry[1:-1, :-2])  # u, d, r, l
+
+        q = np.zeros(grid.shape + (4,))
+        next_q = np.empty_like(q)
+        v = np.zeros(grid.shape) if v0 is None else np.array(v0, dtype=float)
+        next_v = np.empty_like(v)
+        diff = np.empty_like(v)
+        self.sweeps = 0
+        self.stopping.start()
         while True:
-            prev_v = copy.deepcopy(v)
-            delta = 0
-            for y in range(0, self.level.nbLine):
-                for x in range(0, self.level.nbCol):
-                    q = []
-                    for action in a:
-                        ra = -10000  # if cell is a wall
-                        p1 = 0.0
-                        #if self.level.grid[y][x] not in ('P', 'M'):
-                        if action == 'u':
-                            if y > 0:
-                                if self.level.grid[y - 1][x] != '_':
-                                    ra = r[self.level.grid[y - 1][x]]
-                                    p1 = self.get_possible_moves(y-1, x, prev_v, critcal)
-                        elif action == 'd':
-                            if y < self.level.nbLine - 1:
-                                if self.level.grid[y + 1][x] != '_':
-                                    ra = r[self.level.grid[y+1][x]]
-                                    p1 = self.get_possible_moves(y + 1, x, prev_v,critcal)
-                        elif action == 'l':
-                            if x > 0:
-                                if self.level.grid[y][x - 1] != '_':
-                                    ra = r[self.level.grid[y][x-1]]
-                                    p1 = self.get_possible_moves(y, x - 1, prev_v,critcal)
-                        else:
-                            if x < self.level.nbCol - 1:
-                                if self.level.grid[y][x + 1] != '_':
-                                    ra = r[self.level.grid[y][x+1]]
-                                    p1 = self.get_possible_moves(y, x + 1, prev_v,critcal)
-                        q.append(ra + gamma * p1)
-                        #else:
-                        #   q = [-1000, -1000]
-                    v[y][x] = q
-                    delta = max(delta, abs(max(prev_v[y][x]) - max(v[y][x])))
-            if delta < epsilon:
-                return self.best_policy(v)
+            self.sweeps += 1
+            np.multiply(back, v[-1, -1], out=const)
+            np.add(const, lost, out=const)
+            np.multiply(v, coef, out=inner)
+            np.add(inner, const, out=inner)
+            inner[portal] = (v[landing].sum() + self.dead * crack.sum()) / nb_open
+            inner[py, px] = moves.dot(v.ravel()) + self.dead * cracked
+            np.multiply(inner, gamma, out=inner)
+            np.add(inner, rew, out=inner)
+            np.copyto(inner, -10000.0, where=wall)
+            for action, view in enumerate(shifted):
+                next_q[:, :, action] = view
+            np.max(next_q, axis=2, out=next_v)
+            np.subtract(next_v, v, out=diff)
+            q, next_q = next_q, q
+            v, next_v = next_v, v
+            if self.stopping.done(self.sweeps, diff.min(), diff.max(), epsilon, gamma, lambda: np.argmax(q, axis=2)):
+                self.v = v
+                return self.best_policy_np(q)
+
+    def value_iteration_sparse(self, gamma, epsilon, r, critcal, has_sword=False, v0=None):
+        self.has_sword = has_sword
+        model = mdp.compile_model(self.level, r, has_sword, critcal, self.damage, self.dead)
+        v = np.zeros(model.n) if v0 is None else model.state_values(v0)
+        self.sweeps = 0
+        self.stopping.start()
+        while True:
+            self.sweeps += 1
+            q = model.backup(v, gamma)
+            next_v = q.max(axis=0)
+            change = next_v - v
+            v = next_v
+            if self.stopping.done(self.sweeps, change.min(), change.max(), epsilon, gamma, lambda: q.argmax(axis=0)):
+                self.v = model.grid_values(v)
+                return model.policy(q)
+
+    def prioritized_sweeping(self, gamma, epsilon, r, critcal, has_sword=False, v0=None):
+        # the state with the highest bound on its Bellman residual is backed up
+        # first. Changing the value of a state by dv raises the bound of each
+        # predecessor by gamma * p * |dv|, p its probability of moving there.
+        # Stops when every bound is below epsilon, max_sweeps counts n
+        # backups as a sweep
+        self.has_sword = has_sword
+        model = mdp.compile_model(self.level, r, has_sword, critcal, self.damage, self.dead)
+        n = model.n
+        indptr, columns, coefficients = state_rows(model, gamma)
+        rewards = model.R.T.tolist()
+        reverse, hub_states, hub_p = model.predecessors()
+        reverse_ptr = reverse.indptr.tolist()
+        reverse_states = reverse.indices.tolist()
+        reverse_p = reverse.data.tolist()
+        hub_preds = list(zip(hub_states.tolist(), hub_p.tolist()))
+        landing = model.portal.tolist()
+
+        v = np.full(n, r['B'] / (1 - gamma)) if v0 is None else model.state_values(v0)
+        priority = np.abs(model.backup(v, gamma).max(axis=0) - v).tolist()
+        extended = v.tolist() + [1.0, model.portal.dot(v)]
+        heap = [(-p, s) for s, p in enumerate(priority) if p >= epsilon]
+        heapq.heapify(heap)
+        self.backups = 0
+        self.stopping.start()
+        while heap:
+            if self.backups % n == 0 and self.stopping.out_of_budget(self.backups // n):
+                break
+            p, s = heapq.heappop(heap)
+            if -p != priority[s]:  # outdated entry
+                continue
+            q = list(rewards[s])
+            row = len(mdp.ACTIONS) * s
+            for a in range(len(mdp.ACTIONS)):
+                for i in range(indptr[row + a], indptr[row + a + 1]):
+                    q[a] += coefficients[i] * extended[columns[i]]
+            value = max(q)
+            dv = value - extended[s]
+            extended[s] = value
+            priority[s] = 0.0
+            self.backups += 1
+            start, end = reverse_ptr[s], reverse_ptr[s + 1]
+            preds = zip(reverse_states[start:end], reverse_p[start:end])
+            if landing[s]:
+                extended[n + 1] += landing[s] * dv
+                preds = itertools.chain(preds, ((t, w * landing[s]) for t, w in hub_preds))
+            dv = abs(dv)
+            for t, w in preds:
+                priority[t] += gamma * w * dv
+                if priority[t] >= epsilon:
+                    heapq.heappush(heap, (-priority[t], t))
+        self.stopping.converged = not heap
+        v = np.array(extended[:n])
+        self.v = model.grid_values(v)
+        return model.policy(model.backup(v, gamma))
+
+    def best_policy_np(self, q):
+        return [[self.a[i] for i in line] for line in np.argmax(q, axis=2).tolist()]
+
+    @timer
+    def solve_joint(self, gamma, epsilon):
+        # V[has_key, has_sword, has_treasure, critical, y, x]: picking up an
+        # object moves the player to another inventory slice and losing a life
+        # moves it to the critical slice, instead of faking it with rewards
+        grid = self.level.tiles
+        shape = (2, 2, 2, 2) + grid.shape
+        wall = grid == game.WALL
+        crack = grid == game.CRACK
+        trap = grid == game.TRAP
+        enemy = grid == game.ENEMY
+        portal = grid == game.PORTAL
+        landing = ~wall & ~crack
+        nb_open = (~wall).sum()
+        has_key = np.array([False, True]).reshape(2, 1, 1, 1, 1, 1)
+        has_treasure = has_key.reshape(1, 1, 2, 1, 1, 1)
+        pickup_treasure = (grid == game.TREASURE) & has_key
+        win = (grid == game.START) & has_treasure
+
+        rew = np.empty(shape)
+        for k in (0, 1):
+            for s in (0, 1):
+                for t in (0, 1):
+                    r = self.get_reward(has_key=k, has_sword=s, has_treasure=t)
+                    rew[k, s, t] = np.array([r[c] for c in game.TILES], dtype=float)[grid]
+
+        # exits of the moving platforms
+        platforms, moves, cracked = mdp.platform_moves(self.level)
+        py, px = np.divmod(platforms, grid.shape[1])
+
+        entry = np.full(shape[:4] + (grid.shape[0] + 2, grid.shape[1] + 2), -10000.0)
+        inner = entry[..., 1:-1, 1:-1]
+        shifted = (entry[..., :-2, 1:-1], entry[..., 2:, 1:-1], entry[..., 1:-1, 2:], entry[..., 1:-1, :-2])
+        v = np.zeros(shape)
+        next_v = np.empty(shape)
+        hurt = np.empty(shape)
+        cont = np.empty(shape)
+        self.sweeps = 0
+        self.stopping.start()
+        while True:
+            self.sweeps += 1
+            # value of losing a life on each cell
+            hurt[:, :, :, 0] = v[:, :, :, 1]
+            hurt[:, :, :, 1] = self.dead
+            # value of the reaction of each cell, see mdp.cell_rules
+            cont[:] = v
+            cont[..., trap] = 0.1 * hurt[..., trap] + 0.3 * v[..., -1, -1, None] + 0.6 * v[..., trap]
+            cont[:, 0][..., enemy] = 0.7 * v[:, 0][..., enemy] + 0.3 * hurt[:, 0][..., enemy]
+            cont[..., crack] = self.dead
+            cont[..., portal] = ((v[..., landing].sum(axis=-1) + self.dead * crack.sum()) / nb_open)[..., None]
+            if len(platforms):
+                pushed = moves.dot(v.reshape(-1, grid.size).T).T.reshape(shape[:4] + platforms.shape)
+                cont[..., py, px] = pushed + self.dead * cracked
+            # stepping on an object changes the inventory slice
+            np.copyto(inner, cont)
+            np.copyto(inner, cont[1:2], where=grid == game.KEY)
+            np.copyto(inner, cont[:, 1:2], where=grid == game.SWORD)
+            np.copyto(inner, cont[:, :, 1:2], where=pickup_treasure)
+            np.copyto(inner, 0.0, where=win)
+            np.multiply(inner, gamma, out=inner)
+            np.add(inner, rew, out=inner)
+            np.copyto(inner, -10000.0, where=wall)
+
+            np.maximum(shifted[0], shifted[1], out=next_v)
+            np.maximum(next_v, shifted[2], out=next_v)
+            np.maximum(next_v, shifted[3], out=next_v)
+            change = next_v - v
+            v, next_v = next_v, v
+            greedy = lambda: np.argmax(np.stack(shifted, axis=-1), axis=-1)
+            if self.stopping.done(self.sweeps, change.min(), change.max(), epsilon, gamma, greedy):
+                best = greedy()
+                return {
+                    (bool(k), bool(s), bool(t), bool(c)):
+                        [[self.a[i] for i in line] for line in best[k, s, t, c].tolist()]
+                    for k in (0, 1) for s in (0, 1) for t in (0, 1) for c in (0, 1)
+                }
 
     def best_policy(self, v):
         res = []
@@ -160,70 +580,3 @@ class Solver:
                 else:
                     print("_ ", end='')
             print()
-
-    def get_possible_moves(self, y, x, prev_v, critcal):
-        """if self.level.grid[y][x] == 'M':
-            cpt = 0
-            p = []
-            rev = []
-            if y > 0:
-                if self.level.grid[y - 1][x] != '_':
-                    cpt += 1
-                    p.append(max(prev_v[y-1][x]))
-                    rev.append(r[self.level.grid[y-1][x]])
-            if y < self.level.nbLine - 2:
-                if self.level.grid[y - 1][x] != '_':
-                    cpt += 1
-                    p.append(max(prev_v[y+1][x]))
-                    rev.append(r[self.level.grid[y+1][x]])
-            if x > 0:
-                if self.level.grid[y - 1][x] != '_':
-                    cpt += 1
-                    p.append(max(prev_v[y][x-1]))
-                    rev.append(r[self.level.grid[y][x-1]])
-            if x < self.level.nbCol - 1:
-                if self.level.grid[y - 1][x] != '_':
-                    cpt += 1
-                    p.append(max(prev_v[y][x+1]))
-                    rev.append(r[self.level.grid[y][x+1]])
-            p1 = 0
-            for num in p:
-                p1 += num * 1/cpt
-            return p1"""
-        if self.level.grid[y][x] == 'R':
-            loose = self.damage
-            if critcal:
-                loose = self.dead
-            p1 = 0.1 * loose + 0.3 * max(prev_v[self.level.nbLine - 1][self.level.nbCol - 1]) + \
-                 0.6 * max(prev_v[y][x])
-            return p1
-        elif self.level.grid[y][x] == 'C':
-            return self.dead
-        elif self.level.grid[y][x] == 'E':
-            loose = self.damage
-            if critcal:
-                loose = self.dead
-            if self.has_sword:
-                return max(prev_v[y][x])
-            else:
-                return 0.7 * max(prev_v[y][x]) + 0.3 * loose
-        else:
-            return max(prev_v[y][x])
-        """elif self.level.grid[y][x] == 'P':
-            p = []
-            cpt = 0
-            for y in range(0, self.level.nbLine):
-                for x in range(0, self.level.nbCol):
-                    if self.level.grid[y][x] != '_':
-                        if self.level.grid[y][x] != 'C':
-                            p.append(max(prev_v[y][x]))
-                        else:
-                            p.append(self.dead)
-                        cpt += 1
-            p1 = 0
-            for num in p:
-                p1 += 1/cpt * num
-            #print(p)
-            return p1"""
-
-